@@ -0,0 +1,322 @@
+# coding=utf-8
+#===================================================================================================
+#                                                                                    © nemetris GmbH
+# Filename   benchmark.py
+#
+# Author     Thomas Rukwid
+#
+# Date       16.10.2026
+#
+#
+# Notes:
+# ------
+# Load test for the demo server. The script
+# - seeds the test table of demo.db with a number of synthetic rows (bulk insert)
+# - starts the HelloWorld app of cherrypy_demo.py in this process on a local port
+# - runs each scenario with a number of concurrent clients (keep-alive connections)
+# - prints throughput and latency percentiles of each scenario as JSON to stdout, the log of the
+#   demo and the progress go to stderr ( python benchmark.py > report.json )
+#
+# Usage:
+#   python benchmark.py --rows 10000
+#   python benchmark.py --rows 1000000 --reuse --concurrency 16 --requests 2000 --output bench.json
+#   python benchmark.py --scenarios grid_page,grid_search
+#
+# The random numbers (data, offsets, search terms) use a fixed seed, so two runs with the same
+# arguments send the same requests. The test table stays in demo.db after the run, use --reuse to
+# skip the seeding of the next run (the demo server started with cherrypy_demo.py drops the table
+# on its shutdown).
+#===================================================================================================
+import argparse
+import concurrent.futures
+import gzip
+import http.client
+import json
+import logging
+import platform
+import random
+import sqlite3
+import sys
+import threading
+import time
+import urllib.parse
+
+import cherrypy
+
+import cherrypy_demo
+
+FIRST_NAMES = [ "Anna", "Ben", "Clara", "David", "Emma", "Felix", "Greta", "Hans", "Ida", "Jonas",
+                "Karla", "Lukas", "Marie", "Noah", "Olga", "Paul", "Quirin", "Rosa", "Simon", "Tina" ]
+LAST_NAMES  = [ "Müller", "Schmidt", "Schneider", "Fischer", "Weber", "Meyer", "Wagner", "Becker",
+                "Schulz", "Hoffmann", "Koch", "Richter", "Klein", "Wolf", "Neumann", "Schwarz" ]
+SEED_BATCH_SIZE = 50000
+
+#===================================================================================================
+# seed the database
+#===================================================================================================
+def synthetic_rows( count, rng ):
+    '''
+    Generates ( fname, lname, email ) ... the number in the last name keeps ( fname, lname ) unique.
+    '''
+    for i in range( count ):
+        fname = rng.choice( FIRST_NAMES )
+        lname = "{0}{1}".format( rng.choice( LAST_NAMES ), i )
+        yield ( fname, lname, "{0}.{1}@example.com".format( fname, lname ).lower() )
+
+def seed_database( rows, seed, reuse=False ):
+    '''
+    Creates the test table with setup_database() and adds the synthetic rows.
+
+    All rows are inserted in one transaction with executemany. With reuse, an existing table with
+    the requested number of rows is kept. Returns the number of rows in the table.
+    '''
+    with sqlite3.connect( cherrypy_demo.DB_STRING ) as conn:
+        exists = conn.execute( "select count(*) from sqlite_master where type = 'table' and name = 'test'" ).fetchone()[0]
+        if reuse and exists:
+            total = conn.execute( "select count(*) from test" ).fetchone()[0]
+            if total == rows + 4:
+                return total
+        conn.execute( "drop table if exists test_fts" )
+        conn.execute( "drop table if exists test" )
+    cherrypy_demo.setup_database()
+
+    rng  = random.Random( seed )
+    conn = sqlite3.connect( cherrypy_demo.DB_STRING )
+    try:
+        #===========================================================================================
+        # no fsync while we seed, the data can be recreated at any time
+        #===========================================================================================
+        conn.execute( "PRAGMA journal_mode = WAL" )
+        conn.execute( "PRAGMA synchronous = OFF" )
+        conn.execute( "PRAGMA cache_size = -256000" )
+        generator = synthetic_rows( rows, rng )
+        with conn:
+            while True:
+                batch = [ row for _, row in zip( range( SEED_BATCH_SIZE ), generator ) ]
+                if not batch:
+                    break
+                conn.executemany( "INSERT OR IGNORE INTO test VALUES(?,?,?)", batch )
+        conn.execute( "ANALYZE" )
+        return conn.execute( "select count(*) from test" ).fetchone()[0]
+    finally:
+        conn.close()
+
+#===================================================================================================
+# scenarios ... each function returns the next request ( method, path, body ) for a random generator
+#===================================================================================================
+def grid_request( **request ):
+    request.setdefault( "table_name", "test" )
+    request.setdefault( "limit", 100 )
+    request.setdefault( "offset", 0 )
+    return ( "POST", "/get_table_data_all", urllib.parse.urlencode( { "request": json.dumps( request ) } ) )
+
+def scenario_grid_page( rng, total ):
+    return grid_request( offset=rng.randrange( 0, 10 ) * 100 )
+
+def scenario_grid_page_columnar( rng, total ):
+    return grid_request( offset=rng.randrange( 0, 10 ) * 100, format="columnar" )
+
+def scenario_grid_deep_offset( rng, total ):
+    return grid_request( offset=rng.randrange( 0, max( total - 100, 1 ) ),
+                         sort=[ { "field": "lname", "direction": "asc" } ] )
+
+def scenario_grid_sort( rng, total ):
+    field = rng.choice( [ "fname", "lname", "email" ] )
+    return grid_request( offset=rng.randrange( 0, 20 ) * 100,
+                         sort=[ { "field": field, "direction": rng.choice( [ "asc", "desc" ] ) } ] )
+
+def scenario_grid_search( rng, total ):
+    operator = rng.choice( [ "begins", "contains", "is" ] )
+    if operator == "is":
+        field, value = "fname", rng.choice( FIRST_NAMES )
+    else:
+        field, value = "lname", rng.choice( LAST_NAMES )[:rng.randrange( 3, 6 )]
+    return grid_request( search=[ { "field": field, "type": "text", "operator": operator, "value": value } ],
+                         searchLogic="AND",
+                         sort=[ { "field": "email", "direction": "asc" } ] )
+
+def scenario_get_table_data( rng, total ):
+    return ( "GET", "/get_table_data", None )
+
+def scenario_static( rng, total ):
+    # the fingerprinted urls the pages use ( the asset pipeline has built them on server start )
+    urls = sorted( cherrypy_demo.asset_pipeline.manifest.values() ) or [ "/jquery.js", "/w2ui.js", "/w2ui.css" ]
+    return ( "GET", rng.choice( urls + [ "/database" ] ), None )
+
+def scenario_string_reverse( rng, total ):
+    return ( "GET", "/string_reverse?" + urllib.parse.urlencode( { "string_to_reverse": "nemetris{0}".format( rng.random() ) } ), None )
+
+SCENARIOS = {
+    "get_table_data"    : scenario_get_table_data,
+    "grid_page"         : scenario_grid_page,
+    "grid_page_columnar": scenario_grid_page_columnar,
+    "grid_deep_offset"  : scenario_grid_deep_offset,
+    "grid_sort"         : scenario_grid_sort,
+    "grid_search"       : scenario_grid_search,
+    "static"            : scenario_static,
+    "string_reverse"    : scenario_string_reverse,
+}
+# get_table_data returns the whole table, that is a lot of data for a big table
+DEFAULT_SCENARIOS = [ "grid_page", "grid_page_columnar", "grid_deep_offset", "grid_sort", "grid_search", "static", "string_reverse" ]
+
+#===================================================================================================
+# client
+#===================================================================================================
+def percentile( values, fraction ):
+    '''
+    Nearest rank percentile of sorted values.
+    '''
+    if not values:
+        return None
+    return values[ min( len( values ) - 1, int( round( fraction * ( len( values ) - 1 ) ) ) ) ]
+
+def response_ok( response, data ):
+    '''
+    Checks the status of a response ... the w2ui errors (e.g. a rejection of the admission
+    control) come with HTTP 200, so we have to look at the "status" of a JSON body.
+    '''
+    if response.status != 200:
+        return False
+    if response.getheader( "Content-Encoding" ) == "gzip":
+        data = gzip.decompress( data )
+    # our endpoints do not always send a JSON content type, so we look at the body
+    if not data.lstrip().startswith( b"{" ):
+        return True
+    try:
+        return json.loads( data ).get( "status" ) != "error"
+    except ( ValueError, AttributeError ):
+        return False
+
+def run_client( port, requests, results, lock ):
+    '''
+    Sends the requests over one keep-alive connection and appends ( seconds, bytes, ok ) to results.
+    '''
+    conn     = http.client.HTTPConnection( "127.0.0.1", port, timeout=60 )
+    measured = []
+    try:
+        for method, path, body in requests:
+            headers = { "Accept-Encoding": "gzip" }
+            if body is not None:
+                headers["Content-Type"] = "application/x-www-form-urlencoded"
+            start = time.perf_counter()
+            try:
+                conn.request( method, path, body=body, headers=headers )
+                response = conn.getresponse()
+                data     = response.read()
+                ok       = response_ok( response, data )
+            except ( OSError, http.client.HTTPException ):
+                conn.close()
+                conn = http.client.HTTPConnection( "127.0.0.1", port, timeout=60 )
+                data, ok = b"", False
+            measured.append( ( time.perf_counter() - start, len( data ), ok ) )
+    finally:
+        conn.close()
+    with lock:
+        results.extend( measured )
+
+def run_scenario( name, port, total_rows, requests, concurrency, seed ):
+    '''
+    Runs one scenario with a number of concurrent clients and returns its statistics.
+    '''
+    rng     = random.Random( "{0}:{1}".format( seed, name ) )
+    plan    = [ SCENARIOS[name]( rng, total_rows ) for _ in range( requests ) ]
+    results = []
+    lock    = threading.Lock()
+    start   = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor( max_workers=concurrency ) as pool:
+        jobs = [ pool.submit( run_client, port, plan[i::concurrency], results, lock ) for i in range( concurrency ) ]
+        for job in jobs:
+            job.result()
+    seconds   = time.perf_counter() - start
+    latencies = sorted( result[0] for result in results )
+    ms        = lambda value: round( value * 1000.0, 3 ) if value is not None else None
+    return {
+                "requests"       : len( results ),
+                "errors"         : sum( 1 for result in results if not result[2] ),
+                "seconds"        : round( seconds, 3 ),
+                "throughput_rps" : round( len( results ) / seconds, 1 ) if seconds else None,
+                "bytes"          : sum( result[1] for result in results ),
+                "mean_ms"        : ms( sum( latencies ) / len( latencies ) if latencies else None ),
+                "p50_ms"         : ms( percentile( latencies, 0.50 ) ),
+                "p95_ms"         : ms( percentile( latencies, 0.95 ) ),
+                "p99_ms"         : ms( percentile( latencies, 0.99 ) ),
+                "max_ms"         : ms( latencies[-1] if latencies else None ),
+           }
+
+#===================================================================================================
+# server
+#===================================================================================================
+def start_server( port, log_level, mirror=False ):
+    '''
+    Starts the HelloWorld app in this process ... without access log and autoreload, so we
+    measure the server and not the console.
+    '''
+    for name in cherrypy_demo.LOG_LEVELS:
+        logging.getLogger( name ).setLevel( log_level )
+    cherrypy.config.update( { 'server.socket_host'   : '127.0.0.1',
+                              'server.socket_port'   : port,
+                              'engine.autoreload.on' : False,
+                              'log.screen'           : False,
+                              'checker.on'           : False } )
+    cherrypy_demo.memory_mirror.enabled = mirror
+    cherrypy.tree.mount( cherrypy_demo.HelloWorld(), '/', config=cherrypy_demo.app_conf )
+    cherrypy.engine.start()
+    cherrypy.engine.wait( cherrypy.engine.states.STARTED )
+
+def main( argv=None ):
+    parser = argparse.ArgumentParser( description="Load test for the nemetris demo server." )
+    parser.add_argument( "--rows",        type=int, default=10000, help="synthetic rows in the test table (e.g. 10000, 1000000, 10000000)" )
+    parser.add_argument( "--reuse",       action="store_true",     help="keep the test table, if it has the requested number of rows" )
+    parser.add_argument( "--requests",    type=int, default=500,   help="requests per scenario" )
+    parser.add_argument( "--concurrency", type=int, default=8,     help="concurrent clients" )
+    parser.add_argument( "--warmup",      type=int, default=50,    help="requests per scenario before we measure" )
+    parser.add_argument( "--scenarios",   default=",".join( DEFAULT_SCENARIOS ),
+                         help="comma separated list of: " + ", ".join( sorted( SCENARIOS ) ) )
+    parser.add_argument( "--port",        type=int, default=4445 )
+    parser.add_argument( "--seed",        type=int, default=4444 )
+    parser.add_argument( "--mirror",      action="store_true",     help="serve the grid reads from the in-memory mirror" )
+    parser.add_argument( "--log-level",   default="WARNING",       help="level of the webdemo loggers while we measure" )
+    parser.add_argument( "--output",      help="write the JSON report to this file as well" )
+    args = parser.parse_args( argv )
+
+    # stdout is for the JSON report only
+    cherrypy_demo.log_queue.handler.setStream( sys.stderr )
+
+    scenarios = [ name.strip() for name in args.scenarios.split( "," ) if name.strip() ]
+    unknown   = [ name for name in scenarios if name not in SCENARIOS ]
+    if unknown:
+        parser.error( "unknown scenario(s): {0}".format( ", ".join( unknown ) ) )
+
+    seed_start = time.perf_counter()
+    total_rows = seed_database( args.rows, args.seed, args.reuse )
+    report = {
+                "rows"         : total_rows,
+                "seed_seconds" : round( time.perf_counter() - seed_start, 3 ),
+                "requests"     : args.requests,
+                "concurrency"  : args.concurrency,
+                "mirror"       : args.mirror,
+                "seed"         : args.seed,
+                "python"       : platform.python_version(),
+                "sqlite"       : sqlite3.sqlite_version,
+                "cherrypy"     : cherrypy.__version__,
+                "scenarios"    : {},
+             }
+    start_server( args.port, args.log_level, args.mirror )
+    try:
+        for name in scenarios:
+            if args.warmup:
+                run_scenario( name, args.port, total_rows, args.warmup, args.concurrency, args.seed + 1 )
+            report["scenarios"][name] = run_scenario( name, args.port, total_rows, args.requests,
+                                                      args.concurrency, args.seed )
+            print( "{0}: {1}".format( name, json.dumps( report["scenarios"][name] ) ), file=sys.stderr )
+    finally:
+        cherrypy.engine.exit()
+
+    output = json.dumps( report, indent=2 )
+    print( output )
+    if args.output:
+        with open( args.output, "w", encoding="utf-8" ) as f:
+            f.write( output + "\n" )
+
+if __name__ == '__main__':
+    main()
@@ -19,10 +19,13 @@
 # Importent:
 # Unfortunately, SQLite in Python forbids us to share a connection between threads.
 # Since CherryPy is a multi-threaded server, this would be an issue.
-# This is the reason why we open and close a connection to the database on each call.
-# This is clearly not really production friendly, and it is probably advisable to either
-# use a more capable database engine or a higher level library, such as SQLAlchemy,
-# to better support your application’s needs.
+# Opening and closing a connection on each call is not really production friendly, because
+# opening the file, parsing the schema and warming up the page cache costs more than most of
+# our queries. This is the reason why the SQLiteConnectionManager below keeps one long-lived
+# connection per CherryPy worker thread. It is attached to the CherryPy engine and closes all
+# connections when the engine stops. It is still probably advisable to either use a more
+# capable database engine or a higher level library, such as SQLAlchemy, to better support
+# your application’s needs.
 #
 # nemetris has implemented his own higher level library to solve this issue.
 # In productive environments we use PostgreSQL or Oracle as a database. SQLite is just something
@@ -36,13 +39,2367 @@ import sys
 import os
 import json
 import collections
+import csv
+import io
+import contextlib
 import sqlite3
+import threading
+import queue
+import concurrent.futures
+import functools
+import logging
+import logging.handlers
+import random
+import gzip
+import hashlib
+import mimetypes
+import time
+import datetime
+import argparse
+import signal
+import socket
+import subprocess
+from cherrypy.lib import cptools, httputil, static
+from cherrypy.process import plugins
+#===================================================================================================
+# brotli is optional, without it we just build the .gz variants of our static assets
+#===================================================================================================
+try:
+    import brotli
+except ImportError:
+    brotli = None
+#===================================================================================================
+# orjson is optional as well, it serializes our grid results several times faster than json
+#===================================================================================================
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+#===================================================================================================
+# logging ...
+# All our loggers live below "webdemo". A record is only put into a queue by the request thread,
+# the QueueListener of the LogQueuePlugin formats and writes it in its own thread. So a request
+# never waits for the console.
+# - LOG_LEVELS sets the level per logger, e.g. per endpoint (webdemo.<endpoint>)
+# - the SQL statements are logged to webdemo.sql with level DEBUG
+# - the parameters of a request are logged with level DEBUG, with level INFO we log just a
+#   sample (LOG_PARAMETER_SAMPLE_RATE) of the requests
+#===================================================================================================
+LOG_FORMAT                = "[%(asctime)s] %(levelname)s %(name)s: %(message)s"
+LOG_PARAMETER_SAMPLE_RATE = 0.01
+LOG_LEVELS = collections.OrderedDict( [ ( 'webdemo',                    logging.INFO ),
+                                        ( 'webdemo.get_table_data',     logging.INFO ),
+                                        ( 'webdemo.get_table_data_all', logging.INFO ),
+                                        ( 'webdemo.delete_table_data',  logging.INFO ),
+                                        ( 'webdemo.save_table_data',    logging.INFO ),
+                                        ( 'webdemo.string_reverse',     logging.INFO ),
+                                        ( 'webdemo.sql',                logging.WARNING ) ] )
+
+logger = logging.getLogger( "webdemo" )
+
+class StructuredFormatter(logging.Formatter):
+    '''
+    Appends the fields of a record ( extra={ "fields": {...} } ) as key=value pairs.
+    The values are JSON encoded, so the lines are easy to parse.
+    '''
+    def format( self, record ):
+        line   = logging.Formatter.format( self, record )
+        fields = getattr( record, "fields", None )
+        if fields:
+            line += " " + " ".join( "{0}={1}".format( key, json.dumps( value, default=str ) )
+                                    for key, value in fields.items() )
+        return line
+
+class LogQueuePlugin(plugins.SimplePlugin):
+    '''
+    Connects our loggers with a queue. The QueueListener writes the records to the console,
+    it runs while the CherryPy engine is running. Records logged before the start are
+    kept in the queue.
+    '''
+    def __init__( self, bus, root=logger, levels=LOG_LEVELS, stream=None ):
+        plugins.SimplePlugin.__init__( self, bus )
+        self.queue   = queue.Queue( -1 )
+        self.handler = logging.StreamHandler( stream or sys.stdout )
+        self.handler.setFormatter( StructuredFormatter( LOG_FORMAT ) )
+        self.listener = None
+        for name, level in levels.items():
+            logging.getLogger( name ).setLevel( level )
+        root.addHandler( logging.handlers.QueueHandler( self.queue ) )
+        root.propagate = False
+
+    def start( self ):
+        if self.listener is None:
+            self.listener = logging.handlers.QueueListener( self.queue, self.handler )
+            self.listener.start()
+
+    def stop( self ):
+        if self.listener is not None:
+            # writes all records in the queue before it returns
+            self.listener.stop()
+            self.listener = None
+    # start first and stop last, so we see the messages of all other plugins
+    start.priority = 10
+    stop.priority  = 90
+
+log_queue = LogQueuePlugin( cherrypy.engine )
+log_queue.subscribe()
+
+@functools.lru_cache( maxsize=None )
+def endpoint_logger( name ):
+    '''
+    Returns the logger webdemo.<name> ... cached, so a request does not need the lock of getLogger.
+    '''
+    return logger.getChild( name )
+
+def log_parameters( log, kwargs ):
+    '''
+    Logs the parameters of a request, with level INFO just for a sample of the requests.
+    '''
+    if log.isEnabledFor( logging.DEBUG ):
+        log.debug( "parameters", extra={ "fields": kwargs } )
+    elif log.isEnabledFor( logging.INFO ) and random.random() < LOG_PARAMETER_SAMPLE_RATE:
+        log.info( "parameters (sampled)", extra={ "fields": kwargs } )
+
+#===================================================================================================
+# metrics ...
+# The MetricsRegistry keeps counters, gauges and histograms in memory, /metrics renders them in
+# the Prometheus text format. The metrics tool measures each request (latency, in-flight requests,
+# response size), an InstrumentedCursor measures each SQL statement and the rows fetched.
+# stage_timer() measures a part of a handler, e.g. the row conversion or json.dumps.
+#===================================================================================================
+LATENCY_BUCKETS = ( 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0 )
+SIZE_BUCKETS    = ( 256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216 )
+
+class MetricsRegistry(object):
+    '''
+    Counters, gauges and histograms with labels.
+
+    An update is just a few dict operations under one lock. A collector is called on each
+    rendering and returns ( name, labels, value ) tuples for values we read from somewhere else,
+    e.g. the hit counter of the result cache.
+    '''
+    def __init__( self ):
+        self._lock       = threading.Lock()
+        self._metrics    = collections.OrderedDict()
+        self._values     = {}
+        self._collectors = []
+
+    def register( self, name, kind, help_text, buckets=None ):
+        self._metrics[name] = ( kind, help_text, buckets )
+
+    def add_collector( self, collector ):
+        self._collectors.append( collector )
+
+    def inc( self, name, value=1, **labels ):
+        key = ( name, tuple( sorted( labels.items() ) ) )
+        with self._lock:
+            self._values[key] = self._values.get( key, 0 ) + value
+
+    def set( self, name, value, **labels ):
+        key = ( name, tuple( sorted( labels.items() ) ) )
+        with self._lock:
+            self._values[key] = value
+
+    def observe( self, name, value, **labels ):
+        key     = ( name, tuple( sorted( labels.items() ) ) )
+        buckets = self._metrics[name][2]
+        with self._lock:
+            # counts per bucket ( +Inf is the last one ), sum and count
+            values = self._values.get( key )
+            if values is None:
+                values = self._values[key] = [ 0 ] * ( len( buckets ) + 3 )
+            for i, bound in enumerate( buckets ):
+                if value <= bound:
+                    break
+            else:
+                i = len( buckets )
+            values[i]  += 1
+            values[-2] += value
+            values[-1] += 1
+
+    @staticmethod
+    def _labels( labels, extra=() ):
+        items = list( labels ) + list( extra )
+        if not items:
+            return ""
+        return "{" + ",".join( '{0}="{1}"'.format( key, str( value ).replace( "\\", "\\\\" )
+                                                                     .replace( '"', '\\"' )
+                                                                     .replace( "\n", "\\n" ) )
+                               for key, value in items ) + "}"
+
+    def render( self ):
+        '''
+        Returns all metrics in the Prometheus text format (version 0.0.4).
+        '''
+        with self._lock:
+            values = { key: ( list( value ) if isinstance( value, list ) else value )
+                       for key, value in self._values.items() }
+        for collector in self._collectors:
+            for name, labels, value in collector():
+                values[ ( name, tuple( sorted( labels.items() ) ) ) ] = value
+        lines = []
+        for name, ( kind, help_text, buckets ) in self._metrics.items():
+            lines.append( "# HELP {0} {1}".format( name, help_text ) )
+            lines.append( "# TYPE {0} {1}".format( name, kind ) )
+            for ( metric, labels ), value in sorted( values.items() ):
+                if metric != name:
+                    continue
+                if kind != "histogram":
+                    lines.append( "{0}{1} {2}".format( name, self._labels( labels ), value ) )
+                    continue
+                cumulative = 0
+                for bound, count in zip( list( buckets ) + [ "+Inf" ], value ):
+                    cumulative += count
+                    lines.append( "{0}_bucket{1} {2}".format( name, self._labels( labels, [ ( "le", bound ) ] ), cumulative ) )
+                lines.append( "{0}_sum{1} {2}".format( name, self._labels( labels ), value[-2] ) )
+                lines.append( "{0}_count{1} {2}".format( name, self._labels( labels ), value[-1] ) )
+        return "\n".join( lines ) + "\n"
+
+    @contextlib.contextmanager
+    def timer( self, name, **labels ):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe( name, time.perf_counter() - start, **labels )
+
+metrics = MetricsRegistry()
+metrics.register( "webdemo_http_requests_total",           "counter",   "HTTP requests by handler and status." )
+metrics.register( "webdemo_http_requests_in_flight",       "gauge",     "HTTP requests in progress." )
+metrics.register( "webdemo_http_request_duration_seconds", "histogram", "HTTP request latency by handler.", LATENCY_BUCKETS )
+metrics.register( "webdemo_http_response_size_bytes",      "histogram", "HTTP response body size by handler.", SIZE_BUCKETS )
+metrics.register( "webdemo_stage_duration_seconds",        "histogram", "Duration of a stage of a request (connect, rows, serialize).", LATENCY_BUCKETS )
+metrics.register( "webdemo_sql_duration_seconds",          "histogram", "Duration of SQL statements by query and phase (execute, fetch).", LATENCY_BUCKETS )
+metrics.register( "webdemo_sql_rows_fetched_total",        "counter",   "Rows fetched by query." )
+
+def stage_timer( stage ):
+    '''
+    with stage_timer( "serialize" ): ... measures a part of a request.
+    '''
+    return metrics.timer( "webdemo_stage_duration_seconds", stage=stage )
+
+class InstrumentedCursor(object):
+    '''
+    Wraps a sqlite3 cursor and measures execute and fetch of each statement.
+
+    The statements are labeled with the query name given to execute(), e.g. "count" or "page".
+    Without a name we use the first keyword of the statement (select, insert, ...), so the
+    number of labels stays small.
+    '''
+    def __init__( self, cursor, registry=None ):
+        self._cursor   = cursor
+        self._registry = registry or metrics
+        self._query    = None
+
+    def _observe( self, phase, start ):
+        self._registry.observe( "webdemo_sql_duration_seconds", time.perf_counter() - start,
+                                query=self._query, phase=phase )
+
+    def _rows( self, rows ):
+        self._registry.inc( "webdemo_sql_rows_fetched_total", len( rows ), query=self._query )
+        return rows
+
+    def execute( self, statement, parameters=(), query=None ):
+        self._query = query or statement.split( None, 1 )[0].lower()
+        start = time.perf_counter()
+        try:
+            self._cursor.execute( statement, parameters )
+        finally:
+            self._observe( "execute", start )
+        return self
+
+    def executemany( self, statement, seq_of_parameters, query=None ):
+        self._query = query or statement.split( None, 1 )[0].lower()
+        start = time.perf_counter()
+        try:
+            self._cursor.executemany( statement, seq_of_parameters )
+        finally:
+            self._observe( "execute", start )
+        return self
+
+    def fetchone( self ):
+        start = time.perf_counter()
+        row   = self._cursor.fetchone()
+        self._observe( "fetch", start )
+        if row is not None:
+            self._registry.inc( "webdemo_sql_rows_fetched_total", 1, query=self._query )
+        return row
+
+    def fetchmany( self, size ):
+        start = time.perf_counter()
+        rows  = self._cursor.fetchmany( size )
+        self._observe( "fetch", start )
+        return self._rows( rows )
+
+    def fetchall( self ):
+        start = time.perf_counter()
+        rows  = self._cursor.fetchall()
+        self._observe( "fetch", start )
+        return self._rows( rows )
+
+    def __getattr__( self, name ):
+        # description, rowcount, close, ...
+        return getattr( self._cursor, name )
+
+class MetricsTool(cherrypy.Tool):
+    '''
+    tools.metrics.on ... measures each request: latency and response size per handler, number
+    of requests per handler and status and the requests in flight.
+
+    The size is counted while the body is written, so it works for streamed responses as well
+    and it is the size after gzip.
+    '''
+    def __init__( self, registry ):
+        cherrypy.Tool.__init__( self, 'on_start_resource', self._start, priority=10 )
+        self.registry = registry
+
+    def _setup( self ):
+        cherrypy.Tool._setup( self )
+        hooks = cherrypy.serving.request.hooks
+        # after gzip (priority 80)
+        hooks.attach( 'before_finalize', self._count_body, priority=90 )
+        hooks.attach( 'on_end_request', self._end )
+
+    @staticmethod
+    def _handler_name( request ):
+        handler = getattr( request.handler, 'callable', None )
+        if request.config.get( 'tools.staticfile.on' ) or request.config.get( 'tools.staticdir.on' ):
+            return "static"
+        return getattr( handler, '__name__', "other" )
+
+    def _start( self, **kwargs ):
+        request = cherrypy.serving.request
+        request.metrics_start   = time.perf_counter()
+        request.metrics_handler = self._handler_name( request )
+        request.metrics_size    = None
+        self.registry.inc( "webdemo_http_requests_in_flight" )
+
+    def _count_body( self ):
+        request  = cherrypy.serving.request
+        response = cherrypy.serving.response
+        size     = request.metrics_size = [ 0 ]
+        def count( body ):
+            for chunk in body:
+                size[0] += len( chunk )
+                yield chunk
+        response.body = count( response.body )
+
+    def _end( self ):
+        request  = cherrypy.serving.request
+        response = cherrypy.serving.response
+        start    = getattr( request, 'metrics_start', None )
+        if start is None:
+            return
+        handler = request.metrics_handler
+        self.registry.inc( "webdemo_http_requests_in_flight", -1 )
+        self.registry.inc( "webdemo_http_requests_total", handler=handler, status=str( response.status )[:3] )
+        self.registry.observe( "webdemo_http_request_duration_seconds", time.perf_counter() - start, handler=handler )
+        if request.metrics_size is not None:
+            size = request.metrics_size[0]
+        else:
+            # an error page or a file served by a tool
+            size = int( response.headers.get( 'Content-Length' ) or 0 )
+        self.registry.observe( "webdemo_http_response_size_bytes", size, handler=handler )
+
+cherrypy.tools.metrics = MetricsTool( metrics )
+
+#===================================================================================================
+# gobal database definition
+#===================================================================================================
+current_dir = os.path.dirname( os.path.abspath( __file__ ) )
+DB_STRING   = os.path.join( current_dir, 'demo.db' )
+
+#===================================================================================================
+# pragmas for each pooled connection
+# - WAL lets the readers of the grid work in parallel to a writer
+# - synchronous NORMAL is safe in WAL mode and saves one fsync per commit
+# - a negative cache_size is given in KiB (64 MiB page cache per connection)
+# - mmap_size lets SQLite read the database file through memory mapped I/O (256 MiB)
+#===================================================================================================
+DB_PRAGMAS = collections.OrderedDict( [ ( 'journal_mode', 'WAL' ),
+                                        ( 'synchronous',  'NORMAL' ),
+                                        ( 'cache_size',   -64000 ),
+                                        ( 'mmap_size',    268435456 ),
+                                        ( 'temp_store',   'MEMORY' ) ] )
+
+#===================================================================================================
+# connection manager for our sqlite database
+#===================================================================================================
+class SQLiteConnectionManager(plugins.SimplePlugin):
+    '''
+    Keeps one long-lived sqlite3 connection per CherryPy worker thread.
+
+    The manager is a CherryPy engine plugin. A worker thread opens its connection on the first
+    call of connection() and keeps it for all further requests. On the engine stop event all
+    connections are closed.
+
+    Usage in a handler:
+
+        with db_manager.connection() as conn:
+            curs = conn.cursor()
+            ...
+
+    The with statement of a sqlite3 connection does not close it, it just commits the
+    transaction (or does a rollback on an exception).
+    '''
+    def __init__( self, bus, database, pragmas=None ):
+        plugins.SimplePlugin.__init__( self, bus )
+        self.database     = database
+        self.pragmas      = pragmas if pragmas is not None else DB_PRAGMAS
+        self._local       = threading.local()
+        self._lock        = threading.Lock()
+        self._connections = []
+        self._watch_lock    = threading.Lock()
+        self._watch_conn    = None
+        self._watch_version = None
+
+    def connection( self ):
+        '''
+        Returns the connection of the current thread, opens it on the first call.
+        '''
+        conn = getattr( self._local, 'conn', None )
+        if conn is None:
+            conn = self._connect()
+            self._local.conn = conn
+        return conn
+
+    def data_version_changed( self ):
+        '''
+        Checks "PRAGMA data_version" on a dedicated watch connection.
+
+        Returns True, if any other connection has committed a change since the last check. The
+        writes of our own handlers are taken as seen by note_own_write(), so this is mostly
+        another process ( or a write without note_own_write, e.g. a new index ).
+        '''
+        with self._watch_lock:
+            if self._watch_conn is None:
+                self._watch_conn    = self._connect()
+                self._watch_version = None
+            version = self._watch_conn.execute( "PRAGMA data_version" ).fetchone()[0]
+            changed = ( self._watch_version is not None and version != self._watch_version )
+            self._watch_version = version
+            return changed
+
+    def note_own_write( self ):
+        '''
+        Takes the current data_version as seen, call it after the commit of a write of our own
+        handlers. They invalidate the caches of their table, data_version_changed() must not
+        drop the caches of all tables for them.
+        '''
+        with self._watch_lock:
+            if self._watch_conn is not None:
+                self._watch_version = self._watch_conn.execute( "PRAGMA data_version" ).fetchone()[0]
+
+    def _connect( self ):
+        #===========================================================================================
+        # check_same_thread is disabled so that the engine is able to close the connection
+        # on stop from the main thread. A connection is only used by the thread that opened it.
+        #===========================================================================================
+        with stage_timer( "connect" ):
+            conn = sqlite3.connect( self.database, check_same_thread=False )
+            for pragma, value in self.pragmas.items():
+                conn.execute( "PRAGMA {0} = {1}".format( pragma, value ) )
+        with self._lock:
+            self._connections.append( conn )
+        self.bus.log( "SQLite connection opened for thread {0}".format( threading.current_thread().name ) )
+        return conn
+
+    def stop( self ):
+        '''
+        Closes all connections, called on the engine stop event.
+        '''
+        with self._lock:
+            connections       = self._connections
+            self._connections = []
+        for conn in connections:
+            try:
+                conn.close()
+            except sqlite3.Error as e:
+                self.bus.log( "Error while closing SQLite connection: {0}".format( e ) )
+        #===========================================================================================
+        # a new local storage, so that threads open a new connection after an engine restart
+        #===========================================================================================
+        self._local = threading.local()
+        with self._watch_lock:
+            self._watch_conn = None
+        if connections:
+            self.bus.log( "{0} SQLite connection(s) closed".format( len( connections ) ) )
+    # close the connections after cleanup_database (default priority 50) has been called
+    stop.priority = 80
+
+db_manager = SQLiteConnectionManager( cherrypy.engine, DB_STRING )
+db_manager.subscribe()
+
+#===================================================================================================
+# DB executor ... runs the blocking database work outside of the CherryPy HTTP worker threads
+#===================================================================================================
+HTTP_THREAD_POOL  = 30      # CherryPy HTTP worker threads (server.thread_pool)
+DB_WORKERS        = 4       # threads of the DB executor, each with its own pooled connection
+DB_QUEUE_LIMIT    = 64      # jobs (running and waiting) before we reject new jobs
+DB_TIMEOUT        = 10.0    # seconds for one job, including the time in the queue
+DB_PROGRESS_STEPS = 10000   # SQLite VM instructions between two checks of the timeout
+STREAM_QUEUE_SIZE = 8       # chunks buffered between a streaming job and the HTTP thread
+
+class DBExecutorError(Exception):
+    pass
+
+class DBBusyError(DBExecutorError):
+    pass
+
+class DBTimeoutError(DBExecutorError):
+    pass
+
+class DBExecutor(plugins.SimplePlugin):
+    '''
+    A bounded thread pool for our database work with admission control and timeouts.
+
+    The handlers submit a function fn( conn, *args ) and wait for its result. A slow query only
+    blocks one of the DB_WORKERS threads, the HTTP worker threads stay free for cheap requests.
+    - if more than DB_QUEUE_LIMIT jobs are running or waiting, a new job is rejected at once
+      with a DBBusyError
+    - a SQLite progress handler interrupts a query as soon as the job is running longer than
+      its timeout, the caller gets a DBTimeoutError
+    '''
+    def __init__( self, bus, connections, workers=DB_WORKERS, queue_limit=DB_QUEUE_LIMIT, timeout=DB_TIMEOUT,
+                  name="DB Worker" ):
+        plugins.SimplePlugin.__init__( self, bus )
+        self.name        = name
+        self.connections = connections
+        self.workers     = workers
+        self.queue_limit = queue_limit
+        self.timeout     = timeout
+        self._lock       = threading.Lock()
+        self._jobs       = 0
+        self._pool       = None
+
+    def start( self ):
+        self._pool = concurrent.futures.ThreadPoolExecutor( max_workers=self.workers,
+                                                            thread_name_prefix=self.name )
+
+    def stop( self ):
+        pool       = self._pool
+        self._pool = None
+        if pool is not None:
+            pool.shutdown( wait=True, cancel_futures=True )
+    # shut down after the HTTP server (priority 50), but before the connections are closed (80)
+    stop.priority = 60
+
+    def _release( self, future=None ):
+        with self._lock:
+            self._jobs -= 1
+
+    def _submit( self, deadline, fn, args, connections=None ):
+        #===========================================================================================
+        # admission control ... reject the job, if the queue is full
+        #===========================================================================================
+        with self._lock:
+            if self._pool is None or self._jobs >= self.queue_limit:
+                raise DBBusyError( "Server busy, please try again later" )
+            self._jobs += 1
+        try:
+            future = self._pool.submit( self._call, deadline, fn, args, connections or self.connections )
+        except RuntimeError:
+            # the pool has been shut down in the meantime
+            self._release()
+            raise DBBusyError( "Server is shutting down" )
+        future.add_done_callback( self._release )
+        return future
+
+    def _call( self, deadline, fn, args, connections ):
+        if time.monotonic() > deadline[0]:
+            raise DBTimeoutError( "Timeout while waiting in the queue" )
+        conn = connections.connection()
+        conn.set_progress_handler( lambda: time.monotonic() > deadline[0], DB_PROGRESS_STEPS )
+        try:
+            return fn( conn, *args )
+        except sqlite3.OperationalError as e:
+            if time.monotonic() > deadline[0]:
+                raise DBTimeoutError( "Query timeout, please refine your search" ) from e
+            raise
+        finally:
+            conn.set_progress_handler( None, 0 )
+
+    def run( self, fn, *args, timeout=None, connections=None ):
+        '''
+        Runs fn( conn, *args ) in the executor and returns its result.
+
+        connections provides the connection ( e.g. the memory_mirror ), default is our db_manager.
+        '''
+        timeout  = timeout or self.timeout
+        deadline = [ time.monotonic() + timeout ]
+        future   = self._submit( deadline, fn, args, connections )
+        try:
+            #=======================================================================================
+            # one extra second, so that the progress handler is able to interrupt the query
+            #=======================================================================================
+            return future.result( timeout + 1.0 )
+        except concurrent.futures.TimeoutError:
+            future.cancel()
+            raise DBTimeoutError( "Query timeout, please refine your search" )
+
+    def stream( self, fn, *args, timeout=None, connections=None ):
+        '''
+        Runs the generator function fn( conn, *args ) in the executor and returns a generator
+        for the HTTP thread, which yields the same chunks.
+
+        The chunks are handed over by a bounded queue, so a slow client slows down the job
+        instead of filling our memory. The timeout applies to each chunk. The first chunk is
+        fetched before we return, so that an error at the start is raised to the handler.
+        '''
+        timeout   = timeout or self.timeout
+        deadline  = [ time.monotonic() + timeout ]
+        chunks    = queue.Queue( STREAM_QUEUE_SIZE )
+        cancelled = threading.Event()
+        end       = object()
+
+        def put( item ):
+            while not cancelled.is_set():
+                if time.monotonic() > deadline[0]:
+                    raise DBTimeoutError( "Timeout while sending the data" )
+                try:
+                    chunks.put( item, timeout=0.1 )
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        def produce( conn, *args ):
+            try:
+                for chunk in fn( conn, *args ):
+                    if not put( chunk ):
+                        return
+                    deadline[0] = time.monotonic() + timeout
+                put( end )
+            except Exception as e:
+                if( isinstance( e, sqlite3.OperationalError ) and time.monotonic() > deadline[0] ):
+                    e = DBTimeoutError( "Query timeout, please refine your search" )
+                put( e )
+
+        def get():
+            try:
+                item = chunks.get( timeout=timeout + 1.0 )
+            except queue.Empty:
+                raise DBTimeoutError( "Query timeout, please refine your search" )
+            if isinstance( item, Exception ):
+                raise item
+            return item
+
+        def consume( first ):
+            try:
+                item = first
+                while item is not end:
+                    yield item
+                    item = get()
+            finally:
+                cancelled.set()
+
+        self._submit( deadline, produce, args, connections )
+        try:
+            first = get()
+        except Exception:
+            cancelled.set()
+            raise
+        return consume( first )
+
+db_executor = DBExecutor( cherrypy.engine, db_manager )
+db_executor.subscribe()
+
+metrics.register( "webdemo_db_jobs", "gauge", "Jobs running or waiting in the DB executors." )
+metrics.add_collector( lambda: [ ( "webdemo_db_jobs", { "executor": "db" },     db_executor._jobs ),
+                                 ( "webdemo_db_jobs", { "executor": "export" }, export_executor._jobs ) ] )
+
+def dumps_json( value ):
+    '''
+    Serializes a value to JSON (UTF-8 bytes), with orjson if it is installed.
+    '''
+    if orjson is not None:
+        try:
+            return orjson.dumps( value )
+        except TypeError:
+            # e.g. an integer with more than 64 bits ... json is able to handle it
+            pass
+    return json.dumps( value ).encode( 'utf-8' )
+
+def w2ui_error( message ):
+    '''
+    Returns the w2ui error structure for a message (or an exception).
+    '''
+    message = "Fatal Error: {0}".format( message )
+    logger.error( message )
+    result = {
+                "status"  : "error",
+                "message" : message
+             }
+    return  json.dumps( result )
+
+#===================================================================================================
+# paging cache for get_table_data_all
+#===================================================================================================
+class GridPagingCache(object):
+    '''
+    Caches the row counts and the page boundaries of the grid selections.
+
+    The counts are cached per (table, normalized where clause, parameters). The page boundaries
+    remember the sort key of the last row of a page, so that the next page can be selected with
+    a seek (keyset) instead of a "limit ... offset ..." that has to skip all previous rows.
+
+    All entries of a table have to be invalidated on each write to the table. Both caches are
+    bounded, the least recently used entries are dropped first. As in the GridResultCache, each
+    table has a generation counter: a count or boundary that was selected before a write is not
+    stored after the write.
+    '''
+    def __init__( self, max_boundaries=10000, max_counts=10000 ):
+        self.max_boundaries = max_boundaries
+        self.max_counts     = max_counts
+        self._lock          = threading.Lock()
+        self._counts        = collections.OrderedDict()
+        self._boundaries    = collections.OrderedDict()
+        self._generations   = collections.Counter()
+        self._clears        = 0
+
+    @staticmethod
+    def normalize( where_clause ):
+        '''
+        Normalizes the whitespace of a where clause so that it can be used as a cache key.
+        '''
+        return " ".join( where_clause.split() )
+
+    def get_count( self, table_name, where_clause, params ):
+        key = ( table_name, where_clause, tuple(params) )
+        with self._lock:
+            total_rows = self._counts.get( key )
+            if total_rows is not None:
+                self._counts.move_to_end( key )
+            return total_rows
+
+    def generation( self, table_name ):
+        '''
+        Returns the generation of a table, get it before the selection of a count or boundary.
+        '''
+        with self._lock:
+            return ( self._clears, self._generations[table_name] )
+
+    def set_count( self, table_name, where_clause, params, total_rows, generation ):
+        key = ( table_name, where_clause, tuple(params) )
+        with self._lock:
+            if ( self._clears, self._generations[table_name] ) != generation:
+                return
+            self._counts[key] = total_rows
+            self._counts.move_to_end( key )
+            while len( self._counts ) > self.max_counts:
+                self._counts.popitem( last=False )
+
+    def get_boundary( self, table_name, where_clause, params, order_by, offset ):
+        '''
+        Returns the sort key of the row in front of the given offset or None.
+        '''
+        key = ( table_name, where_clause, tuple(params), order_by, offset )
+        with self._lock:
+            last_key = self._boundaries.get( key )
+            if last_key is not None:
+                self._boundaries.move_to_end( key )
+            return last_key
+
+    def set_boundary( self, table_name, where_clause, params, order_by, offset, last_key, generation ):
+        key = ( table_name, where_clause, tuple(params), order_by, offset )
+        with self._lock:
+            if ( self._clears, self._generations[table_name] ) != generation:
+                return
+            self._boundaries[key] = last_key
+            self._boundaries.move_to_end( key )
+            while len( self._boundaries ) > self.max_boundaries:
+                self._boundaries.popitem( last=False )
+
+    def clear( self ):
+        with self._lock:
+            self._clears    += 1
+            self._counts     = collections.OrderedDict()
+            self._boundaries = collections.OrderedDict()
+
+    def invalidate( self, table_name ):
+        '''
+        Drops all counts and page boundaries of a table, call it after each write.
+        '''
+        with self._lock:
+            self._generations[table_name] += 1
+            self._counts     = collections.OrderedDict( ( k, v ) for k, v in self._counts.items() if k[0] != table_name )
+            self._boundaries = collections.OrderedDict( ( k, v ) for k, v in self._boundaries.items()
+                                                        if k[0] != table_name )
+
+paging_cache = GridPagingCache()
+
+#===================================================================================================
+# result cache for get_table_data_all
+#===================================================================================================
+RESULT_CACHE_SIZE = 1000   # number of serialized grid responses we keep in memory
+
+class GridResultCache(object):
+    '''
+    LRU cache of the serialized responses of get_table_data_all.
+
+    The key is the normalized w2ui request (table, search, sort, limit, offset, ...). The entries
+    of a table are dropped on each write to the table. Each table has a generation counter that
+    is incremented on invalidate, so that a response that was selected before a write is not
+    put into the cache after the write.
+    '''
+    def __init__( self, max_entries=RESULT_CACHE_SIZE ):
+        self.max_entries  = max_entries
+        self.hits         = 0
+        self.misses       = 0
+        self._lock        = threading.Lock()
+        self._entries     = collections.OrderedDict()
+        self._generations = collections.Counter()
+
+    @staticmethod
+    def key( table_name, request ):
+        return ( table_name, json.dumps( request, sort_keys=True, separators=( ',', ':' ) ) )
+
+    def get( self, key ):
+        with self._lock:
+            body = self._entries.get( key )
+            if body is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self._entries.move_to_end( key )
+            return body
+
+    def generation( self, table_name ):
+        with self._lock:
+            return self._generations[table_name]
+
+    def put( self, key, body, generation ):
+        with self._lock:
+            if self._generations[key[0]] != generation:
+                return
+            self._entries[key] = body
+            self._entries.move_to_end( key )
+            while len( self._entries ) > self.max_entries:
+                self._entries.popitem( last=False )
+
+    def invalidate( self, table_name ):
+        with self._lock:
+            self._generations[table_name] += 1
+            for key in [ key for key in self._entries if key[0] == table_name ]:
+                del self._entries[key]
+
+    def clear( self ):
+        with self._lock:
+            for table_name in set( key[0] for key in self._entries ):
+                self._generations[table_name] += 1
+            self._entries.clear()
+
+    def stats( self ):
+        with self._lock:
+            return { "hits": self.hits, "misses": self.misses, "entries": len( self._entries ) }
+
+result_cache = GridResultCache()
+
+metrics.register( "webdemo_result_cache_requests_total", "counter", "Lookups in the grid result cache by result (hit, miss)." )
+metrics.add_collector( lambda: [ ( "webdemo_result_cache_requests_total", { "result": "hit" },  result_cache.stats()["hits"] ),
+                                 ( "webdemo_result_cache_requests_total", { "result": "miss" }, result_cache.stats()["misses"] ) ] )
+
+#===================================================================================================
+# schema cache
+#===================================================================================================
+def quote_identifier( name ):
+    '''
+    Quotes a table or column name for a SQL statement.
+    '''
+    return '"{0}"'.format( name.replace( '"', '""' ) )
+
+def column_affinity( declared_type ):
+    '''
+    Returns the type affinity of a declared column type, see https://www.sqlite.org/datatype3.html
+    '''
+    declared_type = ( declared_type or "" ).upper()
+    if "INT" in declared_type:
+        return "INTEGER"
+    if any( name in declared_type for name in ( "CHAR", "CLOB", "TEXT" ) ):
+        return "TEXT"
+    if declared_type == "" or "BLOB" in declared_type:
+        return "BLOB"
+    if any( name in declared_type for name in ( "REAL", "FLOA", "DOUB" ) ):
+        return "REAL"
+    return "NUMERIC"
+
+# tables of SQLite, of the change feed (<table>_changes) and the FTS5 table of the index advisor
+# (<table>_fts) with its shadow tables ... they are not accessible by the grid endpoints
+INTERNAL_TABLE_PREFIXES = ( "sqlite_", )
+INTERNAL_TABLE_SUFFIXES = ( "_changes", "_fts", "_fts_data", "_fts_idx", "_fts_docsize", "_fts_config", "_fts_content" )
+
+def internal_table( table_name ):
+    return table_name.startswith( INTERNAL_TABLE_PREFIXES ) or table_name.endswith( INTERNAL_TABLE_SUFFIXES )
+
+class SchemaCache(object):
+    '''
+    Caches the tables of our database and the type affinity of their columns.
+
+    The cache is built from "PRAGMA table_info" and validates table and field names of a request.
+    The internal tables (see internal_table) are unknown tables for a request, our own code gets
+    them with internal=True.
+    The schema_version of the database is checked on each access, so that the cache is reloaded
+    as soon as the schema changes (e.g. a new table or a new index).
+    '''
+    def __init__( self ):
+        self._lock    = threading.Lock()
+        self._version = None
+        self._tables  = {}
+
+    def _check_version( self, conn ):
+        version = conn.execute( "PRAGMA schema_version" ).fetchone()[0]
+        if version != self._version:
+            tables = conn.execute( "select name from sqlite_master where type in ('table', 'view')" ).fetchall()
+            self._tables  = { name: None for ( name, ) in tables }
+            self._version = version
+
+    def columns( self, conn, table_name, internal=False ):
+        '''
+        Returns an ordered dict column name --> type affinity for the table.
+
+        Raises a ValueError for an unknown table.
+        '''
+        with self._lock:
+            self._check_version( conn )
+            if( not isinstance( table_name, str ) or table_name not in self._tables
+                or ( internal_table( table_name ) and not internal ) ):
+                raise ValueError( "Unknown table: {0}".format( table_name ) )
+            columns = self._tables[table_name]
+            if columns is None:
+                columns = collections.OrderedDict()
+                for row in conn.execute( "PRAGMA table_info({0})".format( quote_identifier( table_name ) ) ):
+                    # row: cid, name, type, notnull, dflt_value, pk
+                    columns[row[1]] = column_affinity( row[2] )
+                self._tables[table_name] = columns
+            return columns
+
+    def has_table( self, conn, table_name, internal=False ):
+        '''
+        Checks if a table exists in our database.
+        '''
+        with self._lock:
+            self._check_version( conn )
+            return( isinstance( table_name, str ) and table_name in self._tables
+                    and ( internal or not internal_table( table_name ) ) )
+
+schema_cache = SchemaCache()
+
+#===================================================================================================
+# search compiler for the w2ui grid
+#===================================================================================================
+SEARCH_DATE_FORMATS = [ "%Y-%m-%d", "%m/%d/%Y" ]  # ISO and the default dateFormat of w2ui (m/d/yyyy)
+SEARCH_IN_LIMIT     = 500                          # values of an "in" search (SQLite allows 999 variables)
+# w2ui 1.5 sends the number operators as symbols ( =, >, <, >=, <= ), we use the names for them
+SEARCH_OPERATOR_NAMES = { "=": "is", ">": "more", "<": "less", ">=": "more or is", "<=": "less or is" }
+
+def escape_like( value ):
+    '''
+    Escapes the wildcards of a value for a "like ? escape '\\'" condition.
+    '''
+    return value.replace( "\\", "\\\\" ).replace( "%", "\\%" ).replace( "_", "\\_" )
+
+def fts_match_condition( fts_table, fts_columns, field, value ):
+    '''
+    Returns a condition on the rowid that uses the FTS5 table for a substring search or None,
+    if the FTS5 table can not be used for this search (e.g. the field is not one of its columns).
+    '''
+    if( fts_table is None or field not in fts_columns or len( value ) < FTS_MIN_LENGTH
+        or not field.replace( "_", "" ).isalnum() ):
+        return None
+    condition = "rowid in ( select rowid from {0} where {0} match ? )".format( quote_identifier( fts_table ) )
+    phrase    = '{0} : "{1}"'.format( field, value.replace( '"', '""' ) )
+    return ( condition, phrase )
+
+def fold_case( value ):
+    '''
+    Folds the ASCII upper case characters to lower case, like the NOCASE collation of SQLite.
+    '''
+    return "".join( character.lower() if "A" <= character <= "Z" else character for character in value )
+
+def prefix_upper_bound( prefix ):
+    '''
+    Returns the smallest string (in NOCASE order) greater than all strings beginning with the
+    folded prefix, or None if there is no such string.
+
+    "begins abc" is "col collate nocase >= 'abc' and col collate nocase < 'abd'". The NOCASE
+    collation compares the folded UTF-8 bytes, so we increment the last character and skip the
+    upper case ASCII characters (they never occur folded) and the surrogates (no valid UTF-8).
+    '''
+    while prefix:
+        code = ord( prefix[-1] ) + 1
+        if code == ord( "A" ):
+            code = ord( "Z" ) + 1
+        if 0xD800 <= code <= 0xDFFF:
+            code = 0xE000
+        if code <= 0x10FFFF:
+            return prefix[:-1] + chr( code )
+        prefix = prefix[:-1]
+    return None
+
+def search_number( value ):
+    '''
+    Converts the value of a search on a number column to int or float.
+
+    The values are bound with their type, so that the comparison with the column (and its index)
+    is numeric and not the comparison of a number with a string.
+    Raises a ValueError for anything else than a number.
+    '''
+    if isinstance( value, bool ) or not isinstance( value, ( int, float, str ) ):
+        raise ValueError( "Invalid number: {0!r}".format( value ) )
+    if isinstance( value, str ):
+        try:
+            return int( value )
+        except ValueError:
+            pass
+        try:
+            return float( value )
+        except ValueError:
+            raise ValueError( "Invalid number: {0!r}".format( value ) )
+    return value
+
+def search_date( value ):
+    '''
+    Converts the value of a date search (see SEARCH_DATE_FORMATS) to a datetime.date.
+
+    Raises a ValueError for an invalid date.
+    '''
+    for date_format in SEARCH_DATE_FORMATS:
+        try:
+            return datetime.datetime.strptime( str( value ).strip(), date_format ).date()
+        except ValueError:
+            pass
+    raise ValueError( "Invalid date: {0!r}".format( value ) )
+
+def search_list( value, convert ):
+    '''
+    Returns the values of an "in" or "not in" search. w2ui sends a list of values or of
+    items { id, text } of a list field.
+    '''
+    values = value if isinstance( value, list ) else [ value ]
+    if len( values ) > SEARCH_IN_LIMIT:
+        raise ValueError( "Too many search values: {0} (max. {1})".format( len( values ), SEARCH_IN_LIMIT ) )
+    return [ convert( item.get( "id" ) if isinstance( item, dict ) else item ) for item in values ]
+
+def search_range( value ):
+    '''
+    Returns the two values of a "between" search.
+    '''
+    if not isinstance( value, list ) or len( value ) != 2:
+        raise ValueError( "Invalid range: {0!r}".format( value ) )
+    return value
+
+def compile_condition( field, field_type, search_type, operator, value, fts_table=None, fts_columns=() ):
+    '''
+    Compiles one w2ui search into a condition and its parameters.
+
+    All conditions on a column are sargable (=, <, >, in and ranges of them), so SQLite can
+    use an index of the column instead of a full table scan. Only "contains" and "ends" need
+    a like, or the FTS5 table, if there is one.
+    Raises a ValueError for an unknown operator or an invalid value.
+    '''
+    column    = quote_identifier( field )
+    requested = operator
+    operator  = SEARCH_OPERATOR_NAMES.get( operator, operator )
+    #===============================================================================================
+    # for all types ...
+    #===============================================================================================
+    if( operator == "null" ):
+        return ( "{0} is null".format( column ), [] )
+    if( operator == "not null" ):
+        return ( "{0} is not null".format( column ), [] )
+    #===============================================================================================
+    # dates ... stored as ISO text ( yyyy-mm-dd or yyyy-mm-dd hh:mm:ss ), a day is the range
+    # [ day, next day ), so that a date with time matches its day as well
+    #===============================================================================================
+    if( search_type == "date" ):
+        day      = lambda date: date.isoformat()
+        next_day = lambda date: ( date + datetime.timedelta( days=1 ) ).isoformat()
+        if( operator == "is" ):
+            date = search_date( value )
+            return ( "( {0} >= ? and {0} < ? )".format( column ), [ day( date ), next_day( date ) ] )
+        if( operator == "between" ):
+            start, end = [ search_date( date ) for date in search_range( value ) ]
+            return ( "( {0} >= ? and {0} < ? )".format( column ), [ day( start ), next_day( end ) ] )
+        if( operator == "less" ):
+            return ( "{0} < ?".format( column ), [ day( search_date( value ) ) ] )
+        if( operator == "more" ):
+            return ( "{0} >= ?".format( column ), [ next_day( search_date( value ) ) ] )
+        if( operator == "less or is" ):
+            return ( "{0} < ?".format( column ), [ next_day( search_date( value ) ) ] )
+        if( operator == "more or is" ):
+            return ( "{0} >= ?".format( column ), [ day( search_date( value ) ) ] )
+        raise ValueError( "Unknown search operator: {0} (date)".format( requested ) )
+    #===============================================================================================
+    # text field operations ....
+    #===============================================================================================
+    if( field_type in ( "TEXT", "BLOB" ) ):
+        #===========================================================================================
+        # =
+        #===========================================================================================
+        if( operator == "is" ):
+            return ( "{0} = ?".format( column ), [ str( value ) ] )
+        #===========================================================================================
+        # in ( ... )
+        #===========================================================================================
+        if( operator in ( "in", "not in" ) ):
+            values = search_list( value, str )
+            return ( "{0} {1} ( {2} )".format( column, operator, ", ".join( "?" * len( values ) ) ), values )
+        #===========================================================================================
+        # like abc% ... as range, so that the NOCASE index of the column is used
+        #===========================================================================================
+        if( operator == "begins" ):
+            prefix = fold_case( str( value ) )
+            if not prefix:
+                return ( "{0} is not null".format( column ), [] )
+            upper = prefix_upper_bound( prefix )
+            if upper is None:
+                return ( "{0} collate nocase >= ?".format( column ), [ prefix ] )
+            return ( "( {0} collate nocase >= ? and {0} collate nocase < ? )".format( column ), [ prefix, upper ] )
+        #===========================================================================================
+        # like %abc%
+        #===========================================================================================
+        if( operator == "contains" ):
+            fts_condition = fts_match_condition( fts_table, fts_columns, field, str( value ) )
+            if fts_condition is not None:
+                return ( fts_condition[0], [ fts_condition[1] ] )
+            return ( "{0} like ? escape '\\'".format( column ), [ "%" + escape_like( str( value ) ) + "%" ] )
+        #===========================================================================================
+        # like %abc ... the FTS5 table finds the candidates, the like checks the end
+        #===========================================================================================
+        if( operator == "ends" ):
+            fts_condition = fts_match_condition( fts_table, fts_columns, field, str( value ) )
+            if fts_condition is not None:
+                return ( "( {0} and {1} like ? escape '\\' )".format( fts_condition[0], column ),
+                         [ fts_condition[1], "%" + escape_like( str( value ) ) ] )
+            return ( "{0} like ? escape '\\'".format( column ), [ "%" + escape_like( str( value ) ) ] )
+        #===========================================================================================
+        # error
+        #===========================================================================================
+        raise ValueError( "Unknown search operator: {0} (TEXT, BLOB)".format( requested ) )
+    #===============================================================================================
+    # numbers ... between includes both values, like the local search of w2ui
+    #===============================================================================================
+    if( operator == "is" ):
+        return ( "{0} = ?".format( column ), [ search_number( value ) ] )
+    if( operator == "between" ):
+        start, end = [ search_number( number ) for number in search_range( value ) ]
+        return ( "( {0} >= ? and {0} <= ? )".format( column ), [ start, end ] )
+    if( operator == "less" ):
+        return ( "{0} < ?".format( column ), [ search_number( value ) ] )
+    if( operator == "more" ):
+        return ( "{0} > ?".format( column ), [ search_number( value ) ] )
+    if( operator == "less or is" ):
+        return ( "{0} <= ?".format( column ), [ search_number( value ) ] )
+    if( operator == "more or is" ):
+        return ( "{0} >= ?".format( column ), [ search_number( value ) ] )
+    if( operator in ( "in", "not in" ) ):
+        values = search_list( value, search_number )
+        return ( "{0} {1} ( {2} )".format( column, operator, ", ".join( "?" * len( values ) ) ), values )
+    raise ValueError( "Unknown search operator: {0} ({1})".format( requested, field_type ) )
+
+def compile_search( searches, search_logic, columns, fts_table=None, fts_columns=() ):
+    '''
+    Compiles the w2ui search filters into a where clause with bound parameters.
+
+    The values are never part of the SQL text, so the same search returns the same statement
+    and SQLite is able to reuse the prepared statement from its cache.
+    The operators depend on the type of the search (date) and on the type affinity of the
+    column (text or number), see compile_condition. Conditions with more than one comparison
+    are in brackets, so that they are combined correctly with the search logic (AND, OR).
+    If the table has a FTS5 shadow table (fts_table), "contains" and "ends" on its columns
+    (fts_columns) use its trigram index instead of a full table scan.
+    Returns the where clause (without "where") and the parameter list.
+    Raises a ValueError for an unknown field, operator or search logic or an invalid value.
+    '''
+    search_logic = ( search_logic or "AND" )
+    if not isinstance( search_logic, str ) or search_logic.upper() not in ( "AND", "OR" ):
+        raise ValueError( "Unknown search logic: {0}".format( search_logic ) )
+    search_logic = search_logic.upper()
+    if not isinstance( searches, list ) or not all( isinstance( search, dict ) for search in searches ):
+        raise ValueError( "Invalid search: {0!r}".format( searches ) )
+    conditions = []
+    params     = []
+    for search in searches:
+        current_field    = search.get( 'field' )
+        current_operator = search.get( 'operator' )
+        current_value    = search.get( "value" )
+        endpoint_logger( "sql" ).debug( "search operation", extra={ "fields": { "field"        : current_field,
+                                                                                "operator"     : current_operator,
+                                                                                "search_logic" : search_logic } } )
+        #===========================================================================================
+        # get type of field from the schema ...
+        # we need this so that we can create a correct SQL statement
+        #===========================================================================================
+        if not isinstance( current_field, str ) or current_field not in columns:
+            raise ValueError( "Unknown search field: {0}".format( current_field ) )
+        condition, condition_params = compile_condition( current_field, columns[current_field], search.get( 'type' ),
+                                                         current_operator, current_value, fts_table, fts_columns )
+        conditions.append( condition )
+        params.extend( condition_params )
+    return ( ( " " + search_logic + " " ).join( conditions ), params )
+
+def compile_sort( sorts, columns ):
+    '''
+    Compiles the w2ui sort data into a list of (column, direction) tuples.
+
+    The rowid is always added as the last sort column, so that the sort key of a row is unique
+    and we can use it for the keyset pagination.
+    Raises a ValueError for an unknown field or direction.
+    '''
+    if not isinstance( sorts, list ) or not all( isinstance( sort, dict ) for sort in sorts ):
+        raise ValueError( "Invalid sort: {0!r}".format( sorts ) )
+    order_columns = []
+    for sort in sorts:
+        current_field     = sort.get( 'field' )
+        current_direction = sort.get( 'direction' ) or 'asc'
+        if not isinstance( current_field, str ) or current_field not in columns:
+            raise ValueError( "Unknown sort field: {0}".format( current_field ) )
+        if not isinstance( current_direction, str ) or current_direction.lower() not in ( 'asc', 'desc' ):
+            raise ValueError( "Unknown sort direction: {0}".format( current_direction ) )
+        order_columns.append( ( current_field, current_direction.lower() ) )
+    order_columns.append( ( "rowid", "asc" ) )
+    return order_columns
+
+#===================================================================================================
+# index advisor
+#===================================================================================================
+INDEX_ADVISOR_THRESHOLD = 20    # number of searches/sorts on a column before we create an index
+COVERING_INDEX_COLUMNS  = 4     # tables up to this number of columns get covering indexes
+FTS_ENABLED             = True  # create FTS5 shadow tables for "contains" and "ends" searches
+FTS_MIN_LENGTH          = 3     # the trigram tokenizer needs at least 3 characters
+
+def fts_table_name( table_name ):
+    return table_name + "_fts"
+
+def fts_search_table( conn, table_name ):
+    '''
+    Returns the FTS5 shadow table of a table and its columns for compile_search, or
+    ( None, () ), if the index advisor has not created one yet.
+    '''
+    fts_table = fts_table_name( table_name )
+    if not schema_cache.has_table( conn, fts_table, internal=True ):
+        return ( None, () )
+    return ( fts_table, schema_cache.columns( conn, fts_table, internal=True ) )
+
+class IndexAdvisor(plugins.SimplePlugin):
+    '''
+    Tracks which columns are searched and sorted most often and creates indexes for them.
+
+    As soon as a column was used INDEX_ADVISOR_THRESHOLD times, we create an index with this
+    column as the first key. For small tables the index contains all other columns as well, so
+    that SQLite can answer the count and page queries from the index alone (covering index).
+    "begins" searches get an index with COLLATE NOCASE, because their prefix range compares
+    with COLLATE NOCASE (see compile_condition).
+
+    "contains" and "ends" searches can not use a b-tree index at all. With FTS_ENABLED the table
+    gets a FTS5 shadow table with the trigram tokenizer for all its text columns. Triggers keep
+    the shadow table in sync with the table.
+
+    The indexes are built by a background thread with its own connection, not in the request
+    which reached the threshold: on a large table a CREATE INDEX takes longer than DB_TIMEOUT.
+    If a build fails, the column is counted again from zero and the build is retried as soon
+    as it reaches the threshold again.
+    '''
+    def __init__( self, bus, threshold=INDEX_ADVISOR_THRESHOLD, fts_enabled=FTS_ENABLED ):
+        plugins.SimplePlugin.__init__( self, bus )
+        self.threshold   = threshold
+        self.fts_enabled = fts_enabled
+        self._lock       = threading.Lock()
+        self._usage      = collections.Counter()
+        self._building   = set()
+        self._built      = set()
+        self._executor   = None
+        self._conn       = None
+
+    def stop( self ):
+        '''
+        Cancels the waiting builds and interrupts the running one, called on the engine stop event.
+        '''
+        with self._lock:
+            executor       = self._executor
+            self._executor = None
+            if self._conn is not None:
+                self._conn.interrupt()
+        if executor is not None:
+            executor.shutdown( wait=True, cancel_futures=True )
+        with self._lock:
+            self._building.clear()
+    # before the connections of the db_manager (80)
+    stop.priority = 60
+
+    def record( self, table_name, columns, searches, order_columns ):
+        '''
+        Counts the columns used by a grid request and starts the index builds if needed.
+        '''
+        keys = set()
+        for search in searches:
+            field = search.get( 'field' )
+            if field not in columns:
+                continue
+            operator = search.get( 'operator' )
+            if operator in ( "contains", "ends" ):
+                if self.fts_enabled:
+                    keys.add( ( table_name, "fts", None ) )
+            elif( operator == "begins" and columns[field] == "TEXT" ):
+                keys.add( ( table_name, field, "NOCASE" ) )
+            else:
+                keys.add( ( table_name, field, "BINARY" ) )
+        for column, _ in order_columns:
+            if column != "rowid":
+                keys.add( ( table_name, column, "BINARY" ) )
+
+        with self._lock:
+            for key in keys:
+                if key in self._built or key in self._building:
+                    continue
+                self._usage[key] += 1
+                if self._usage[key] >= self.threshold:
+                    if self._executor is None:
+                        self._executor = concurrent.futures.ThreadPoolExecutor( max_workers=1,
+                                                                                thread_name_prefix="IndexAdvisor" )
+                    self._building.add( key )
+                    self._executor.submit( self._build, key, columns )
+
+    def _build( self, key, columns ):
+        '''
+        Creates the index (or the FTS5 table) of a key in the background thread.
+        '''
+        table_name = key[0]
+        conn       = db_manager.connection()
+        with self._lock:
+            self._conn = conn
+        try:
+            if key[1] == "fts":
+                self._create_fts_table( conn, table_name, columns )
+            else:
+                self._create_index( conn, table_name, columns, key[1], key[2] )
+        except sqlite3.Error as e:
+            logger.warning( "IndexAdvisor: could not create index for {0}: {1}".format( key, e ) )
+            with self._lock:
+                self._usage[key] = 0
+        else:
+            with self._lock:
+                self._built.add( key )
+        finally:
+            with self._lock:
+                self._conn = None
+                self._building.discard( key )
+
+    def _create_index( self, conn, table_name, columns, field, collation ):
+        nocase        = ( collation == "NOCASE" )
+        index_name    = "ix_auto_{0}_{1}{2}".format( table_name, field, "_nocase" if nocase else "" )
+        index_columns = [ quote_identifier( field ) + ( " collate nocase" if nocase else "" ) ]
+        if len( columns ) <= COVERING_INDEX_COLUMNS:
+            index_columns.extend( quote_identifier( column ) for column in columns if column != field )
+        statement = "create index if not exists {0} on {1}( {2} )".format( quote_identifier( index_name ),
+                                                                            quote_identifier( table_name ),
+                                                                            ", ".join( index_columns ) )
+        logger.info( "IndexAdvisor: {0}".format( statement ) )
+        conn.execute( statement )
+
+    def _create_fts_table( self, conn, table_name, columns ):
+        text_columns = [ column for column, affinity in columns.items() if affinity == "TEXT" ]
+        if not text_columns:
+            return
+        fts_table  = quote_identifier( fts_table_name( table_name ) )
+        table      = quote_identifier( table_name )
+        names      = ", ".join( quote_identifier( column ) for column in text_columns )
+        new_values = ", ".join( "new." + quote_identifier( column ) for column in text_columns )
+        old_values = ", ".join( "old." + quote_identifier( column ) for column in text_columns )
+        logger.info( "IndexAdvisor: create FTS5 table {0}".format( fts_table ) )
+        with conn:
+            conn.execute( '''create virtual table if not exists {0} using fts5( {1}, content='{2}',
+                                                                              content_rowid='rowid',
+                                                                              tokenize='trigram' )
+                          '''.format( fts_table, names, table_name.replace( "'", "''" ) ) )
+            conn.execute( '''create trigger if not exists {0} after insert on {1} begin
+                                 insert into {2}( rowid, {3} ) values( new.rowid, {4} );
+                             end
+                          '''.format( quote_identifier( fts_table_name( table_name ) + "_ai" ),
+                                      table, fts_table, names, new_values ) )
+            conn.execute( '''create trigger if not exists {0} after delete on {1} begin
+                                 insert into {2}( {2}, rowid, {3} ) values( 'delete', old.rowid, {4} );
+                             end
+                          '''.format( quote_identifier( fts_table_name( table_name ) + "_ad" ),
+                                      table, fts_table, names, old_values ) )
+            conn.execute( '''create trigger if not exists {0} after update on {1} begin
+                                 insert into {2}( {2}, rowid, {3} ) values( 'delete', old.rowid, {4} );
+                                 insert into {2}( rowid, {3} ) values( new.rowid, {5} );
+                             end
+                          '''.format( quote_identifier( fts_table_name( table_name ) + "_au" ),
+                                      table, fts_table, names, old_values, new_values ) )
+            conn.execute( "insert into {0}( {0} ) values( 'rebuild' )".format( fts_table ) )
+
+index_advisor = IndexAdvisor( cherrypy.engine )
+index_advisor.subscribe()
+
+#===================================================================================================
+# page cache for our html pages
+#===================================================================================================
+class CachedPage(object):
+    '''
+    One html page of the PageCache: the content as bytes, gzipped and the ETag.
+    '''
+    def __init__( self, mtime, content ):
+        self.mtime   = mtime
+        self.content = content
+        self.gzipped = gzip.compress( content, compresslevel=9 )
+        self.etag    = hashlib.sha1( content ).hexdigest()
+
+class PageCache(object):
+    '''
+    Keeps our html pages in memory.
+
+    A page is read from disk on the first request and again only if the mtime of the file has
+    changed. The gzipped content is compressed once when the page is loaded. Each page gets a
+    strong ETag, so that the browser can revalidate its copy and gets a 304 without a body if
+    the page has not changed.
+    '''
+    def __init__( self, directory, rewrite=None ):
+        self.directory = directory
+        self.rewrite   = rewrite    # optional function to rewrite the html content on load
+        self._lock     = threading.Lock()
+        self._pages    = {}
+
+    def clear( self ):
+        with self._lock:
+            self._pages = {}
+
+    def get( self, filename ):
+        '''
+        Returns the CachedPage of a file, (re)loads the file if needed.
+        '''
+        path  = os.path.join( self.directory, filename )
+        mtime = os.stat( path ).st_mtime_ns
+        page  = self._pages.get( filename )
+        if page is None or page.mtime != mtime:
+            with open( path, 'rb' ) as f:
+                content = f.read()
+            if self.rewrite is not None:
+                content = self.rewrite( content )
+            page = CachedPage( mtime, content )
+            with self._lock:
+                self._pages[filename] = page
+        return page
+
+    def serve( self, filename ):
+        '''
+        Serves a page in a handler: sets the headers, answers If-None-Match with a 304 and returns
+        the gzipped content, if the client accepts it.
+        '''
+        page     = self.get( filename )
+        request  = cherrypy.serving.request
+        response = cherrypy.serving.response
+        use_gzip = False
+        for coding in request.headers.elements( 'Accept-Encoding' ):
+            if coding.value in ( 'gzip', 'x-gzip' ) and coding.qvalue > 0:
+                use_gzip = True
+        response.headers['Content-Type']  = 'text/html;charset=utf-8'
+        response.headers['Cache-Control'] = 'private, no-cache'
+        response.headers['Vary']          = 'Accept-Encoding'
+        #===========================================================================================
+        # a strong ETag is valid for one representation, so the gzipped page gets its own ETag
+        #===========================================================================================
+        response.headers['ETag'] = '"{0}{1}"'.format( page.etag, "-gzip" if use_gzip else "" )
+        cptools.validate_etags()
+        if use_gzip:
+            response.headers['Content-Encoding'] = 'gzip'
+            return page.gzipped
+        return page.content
+
+page_cache = PageCache( current_dir )
+#===================================================================================================
+# the page handlers serve the gzipped bytes on their own
+#===================================================================================================
+PAGE_CONFIG = { 'tools.gzip.on': False }
+
+#===================================================================================================
+# static asset pipeline
+#===================================================================================================
+ASSET_URL_PREFIX = "/assets/"
+ASSET_MAX_AGE    = 365 * 24 * 3600   # fingerprinted assets never change
+IMAGE_MAX_AGE    = 24 * 3600         # the jquery ui images are not fingerprinted
+
+class AssetPipeline(plugins.SimplePlugin):
+    '''
+    Builds fingerprinted and precompressed copies of our static assets on engine start.
+
+    Each asset (url --> file) is written to the build directory as <name>.<content hash>.<ext>
+    together with a .gz variant (and a .br variant, if the brotli module is installed). The files
+    are only written if they do not exist yet, so a restart without changes costs just the
+    hashing. The html pages reference the fingerprinted urls (see rewrite_urls), so that we can
+    serve them with "Cache-Control: immutable" ... a changed file gets a new url.
+    The jquery ui css references its images relative to its own url, so we serve the images
+    below the same prefix.
+    '''
+    def __init__( self, bus, assets, build_dir, images_dir ):
+        plugins.SimplePlugin.__init__( self, bus )
+        self.assets     = assets
+        self.build_dir  = build_dir
+        self.images_dir = images_dir
+        self.manifest   = {}    # url --> fingerprinted url
+        self._files     = {}    # fingerprinted name --> path of the file in the build directory
+
+    def start( self ):
+        self.build()
+
+    def build( self ):
+        os.makedirs( self.build_dir, exist_ok=True )
+        manifest = {}
+        files    = {}
+        for url, source in self.assets.items():
+            with open( source, 'rb' ) as f:
+                content = f.read()
+            base, ext = os.path.splitext( url.lstrip( "/" ) )
+            name      = "{0}.{1}{2}".format( base, hashlib.sha1( content ).hexdigest()[:12], ext )
+            path      = os.path.join( self.build_dir, name )
+            self._write( path, lambda: content )
+            self._write( path + ".gz", lambda: gzip.compress( content, compresslevel=9 ) )
+            if brotli is not None:
+                self._write( path + ".br", lambda: brotli.compress( content, quality=11 ) )
+            manifest[url] = ASSET_URL_PREFIX + name
+            files[name]   = path
+        self.manifest = manifest
+        self._files   = files
+        self.bus.log( "Asset pipeline: {0} assets in {1}".format( len( files ), self.build_dir ) )
+
+    @staticmethod
+    def _write( path, produce ):
+        #===========================================================================================
+        # the name contains the content hash, so an existing file is always up to date
+        # we write to a temporary file first, so that nobody ever sees half a file
+        #===========================================================================================
+        if os.path.exists( path ):
+            return
+        temp_path = "{0}.{1}.tmp".format( path, os.getpid() )
+        with open( temp_path, 'wb' ) as f:
+            f.write( produce() )
+        os.replace( temp_path, path )
+
+    def rewrite_urls( self, html ):
+        '''
+        Replaces the plain asset urls in a html page with the fingerprinted urls.
+        '''
+        for url, fingerprinted_url in self.manifest.items():
+            html = html.replace( '"{0}"'.format( url ).encode(), '"{0}"'.format( fingerprinted_url ).encode() )
+        return html
+
+    def serve( self, name ):
+        '''
+        Serves an asset in a handler, prefers the precompressed variants.
+        '''
+        request  = cherrypy.serving.request
+        response = cherrypy.serving.response
+        response.headers.pop( 'Pragma', None )
+        #===========================================================================================
+        # jquery ui images ... already compressed, so we serve them as they are
+        #===========================================================================================
+        if name.startswith( "images/" ):
+            image = name[len( "images/" ):]
+            path  = os.path.join( self.images_dir, image )
+            # the caching headers only for an existing file, a 404 must not be cached
+            if image != os.path.basename( image ) or not os.path.isfile( path ):
+                raise cherrypy.NotFound()
+            response.headers['Cache-Control'] = 'public, max-age={0}'.format( IMAGE_MAX_AGE )
+            response.headers['Expires']       = httputil.HTTPDate( time.time() + IMAGE_MAX_AGE )
+            return static.serve_file( path )
+
+        path = self._files.get( name )
+        if path is None:
+            raise cherrypy.NotFound()
+        content_type = mimetypes.guess_type( name )[0]
+        accepted     = set( coding.value for coding in request.headers.elements( 'Accept-Encoding' )
+                            if coding.qvalue > 0 )
+        if "br" in accepted and os.path.exists( path + ".br" ):
+            path = path + ".br"
+            response.headers['Content-Encoding'] = 'br'
+        elif( "gzip" in accepted or "x-gzip" in accepted ):
+            path = path + ".gz"
+            response.headers['Content-Encoding'] = 'gzip'
+        if not os.path.isfile( path ):
+            response.headers.pop( 'Content-Encoding', None )
+            raise cherrypy.NotFound()
+        response.headers['Vary']          = 'Accept-Encoding'
+        response.headers['Cache-Control'] = 'public, max-age={0}, immutable'.format( ASSET_MAX_AGE )
+        response.headers['Expires']       = httputil.HTTPDate( time.time() + ASSET_MAX_AGE )
+        return static.serve_file( path, content_type )
+
+#===================================================================================================
+# the asset handler serves the precompressed files on its own
+#===================================================================================================
+ASSET_CONFIG = { 'tools.gzip.on': False }
+
+#===================================================================================================
+# bulk writes for the w2ui grid
+#===================================================================================================
+WRITE_BATCH_SIZE = 500   # number of rowids per "rowid in (...)" statement (SQLite allows 999 variables)
+
+def invalidate_table_caches( table_name ):
+    '''
+    Drops all cached data of a table, call it after each write to the table.
+    '''
+    paging_cache.invalidate( table_name )
+    result_cache.invalidate( table_name )
+    change_tracker.notify()
+
+def invalidate_all_caches():
+    '''
+    Drops the cached data of all tables, e.g. after a write of another process.
+    '''
+    paging_cache.clear()
+    result_cache.clear()
+    change_tracker.notify()
+
+def batches( values, batch_size=WRITE_BATCH_SIZE ):
+    for i in range( 0, len( values ), batch_size ):
+        yield values[i:i + batch_size]
+
+def delete_records( conn, table_name, recids ):
+    '''
+    Deletes the records with the given rowids in batches of "rowid in (...)" statements.
+
+    The caller is responsible for the transaction, so that all batches are committed at once.
+    Returns the number of deleted rows.
+    '''
+    curs    = conn.cursor()
+    deleted = 0
+    for batch in batches( recids ):
+        statement = "delete from {0} where rowid in ( {1} )".format( quote_identifier( table_name ),
+                                                                     ", ".join( "?" * len( batch ) ) )
+        curs.execute( statement, batch )
+        deleted += curs.rowcount
+    return deleted
+
+def validate_changes( changes ):
+    '''
+    Checks the shape of the changes of a w2ui grid: a list of objects.
+    Raises a ValueError otherwise.
+    '''
+    if not isinstance( changes, list ):
+        raise ValueError( "Invalid changes: {0!r}".format( changes ) )
+    for change in changes:
+        if not isinstance( change, dict ):
+            raise ValueError( "Invalid change: {0!r}".format( change ) )
+    return changes
+
+def change_recid( change ):
+    '''
+    Returns the rowid of a change as int, or None for a new record without a recid.
+
+    JSON booleans are no rowids ( True would be rowid 1 ), numeric strings are accepted.
+    Raises a ValueError for any other recid.
+    '''
+    recid = change.get( "recid" )
+    if recid is None:
+        return None
+    if isinstance( recid, bool ) or not isinstance( recid, ( int, str ) ):
+        raise ValueError( "Invalid recid: {0!r}".format( recid ) )
+    try:
+        return int( recid )
+    except ValueError:
+        raise ValueError( "Invalid recid: {0!r}".format( recid ) )
+
+def save_records( conn, table_name, columns, changes ):
+    '''
+    Upserts the changes of a w2ui grid: [ { "recid": 1, "field": "new value", ... }, ... ]
+
+    Records with an existing rowid are updated, all others are inserted. Updates with the same
+    set of fields share one statement, which is executed with executemany. Inserts are executed
+    row by row (with the same prepared statement), because we need the new rowids.
+    The caller is responsible for the transaction, so that all changes are committed at once.
+    Returns the list of the affected rowids.
+    Raises a ValueError for an invalid change, an invalid recid or an unknown field.
+    '''
+    curs    = conn.cursor()
+    changes = [ dict( change, recid=change_recid( change ) ) for change in validate_changes( changes ) ]
+    #===============================================================================================
+    # which of the records do exist already?
+    #===============================================================================================
+    recids   = [ change["recid"] for change in changes if change["recid"] is not None ]
+    existing = set()
+    for batch in batches( recids ):
+        statement = "select rowid from {0} where rowid in ( {1} )".format( quote_identifier( table_name ),
+                                                                           ", ".join( "?" * len( batch ) ) )
+        existing.update( rowid for ( rowid, ) in curs.execute( statement, batch ) )
+    #===============================================================================================
+    # group the changes by their fields
+    #===============================================================================================
+    updates = collections.OrderedDict()
+    inserts = collections.OrderedDict()
+    for change in changes:
+        fields = tuple( field for field in change if field != "recid" )
+        for field in fields:
+            if field not in columns:
+                raise ValueError( "Unknown field: {0}".format( field ) )
+        if change.get( "recid" ) in existing:
+            updates.setdefault( fields, [] ).append( [ change[field] for field in fields ] + [ change["recid"] ] )
+        elif fields:
+            inserts.setdefault( fields, [] ).append( [ change[field] for field in fields ] )
+    #===============================================================================================
+    # one executemany per group
+    #===============================================================================================
+    affected = [ recid for recid in recids if recid in existing ]
+    for fields, rows in updates.items():
+        if not fields:
+            continue
+        statement = "update {0} set {1} where rowid = ?".format( quote_identifier( table_name ),
+                                                                 ", ".join( "{0} = ?".format( quote_identifier( field ) )
+                                                                            for field in fields ) )
+        curs.executemany( statement, rows )
+    for fields, rows in inserts.items():
+        statement = "insert into {0}( {1} ) values( {2} )".format( quote_identifier( table_name ),
+                                                                   ", ".join( quote_identifier( field ) for field in fields ),
+                                                                   ", ".join( "?" * len( fields ) ) )
+        for row in rows:
+            curs.execute( statement, row )
+            affected.append( curs.lastrowid )
+    return affected
+
+#===================================================================================================
+# in-memory mirror of hot tables
+#===================================================================================================
+MIRROR_ENABLED            = False        # or --mirror on the command line
+MIRROR_TABLES             = [ "test" ]   # tables, whose grid reads are served by the mirror
+MIRROR_RECONCILE_INTERVAL = 5.0          # seconds between two checks of the disk database
+
+class MemoryMirror(plugins.SimplePlugin):
+    '''
+    A copy of our database in a shared-cache in-memory database for the grid reads.
+
+    On start the disk database is copied with the backup API into a new in-memory database
+    ( a "generation" with its own URI file:...?mode=memory&cache=shared ). Each thread reads with
+    its own connection to the current generation. The writer connection keeps the generation
+    alive and has the disk database attached as "disk".
+
+    - the delete/save endpoints write to disk first, then write_through() copies the affected
+      rows from disk to the mirror
+    - a Monitor checks "PRAGMA data_version" of the disk database. If someone else (another
+      process, an import, a new index) has changed it, resync() creates a new generation.
+      A thread switches to the new generation with its next call of connection(), the old one
+      is freed as soon as its last reader has switched.
+
+    The readers use read_uncommitted, so they are not blocked by the table locks of the shared
+    cache while the writer applies a change ( which is committed on disk already ). The writer
+    updates the changed rows in place, so a reader may see a batch half applied, but never a
+    saved row missing.
+    '''
+    def __init__( self, bus, database, tables=MIRROR_TABLES, enabled=MIRROR_ENABLED,
+                  interval=MIRROR_RECONCILE_INTERVAL ):
+        plugins.SimplePlugin.__init__( self, bus )
+        self.database       = database
+        self.tables         = set( tables )
+        self.enabled        = enabled
+        self.interval       = interval
+        self._lock          = threading.RLock()
+        self._local         = threading.local()
+        self._generation    = 0
+        self._uri           = None
+        self._writer        = None
+        self._readers       = []
+        self._watch         = None
+        self._watch_version = None
+        self._monitor       = None
+
+    def serves( self, table_name ):
+        '''
+        Checks if the grid reads of a table are served by the mirror.
+        '''
+        return self._uri is not None and isinstance( table_name, str ) and table_name in self.tables
+
+    def start( self ):
+        if not self.enabled:
+            return
+        self.resync()
+        self._monitor = plugins.Monitor( self.bus, self.reconcile, frequency=self.interval, name="MemoryMirror" )
+        self._monitor.start()
+    # after setup_database (default priority 50)
+    start.priority = 75
+
+    def stop( self ):
+        if self._monitor is not None:
+            self._monitor.stop()
+            self._monitor = None
+        with self._lock:
+            connections = self._readers + [ conn for conn in ( self._writer, self._watch ) if conn is not None ]
+            self._readers = []
+            self._writer  = None
+            self._watch   = None
+            self._uri     = None
+            self._local   = threading.local()
+        for conn in connections:
+            conn.close()
+    # before the connections of the db_manager (80)
+    stop.priority = 70
+
+    def connection( self ):
+        '''
+        Returns the connection of the current thread to the current generation.
+        '''
+        local = self._local
+        if getattr( local, 'generation', None ) != self._generation:
+            old = getattr( local, 'conn', None )
+            with self._lock:
+                conn = sqlite3.connect( self._uri, uri=True, check_same_thread=False )
+                conn.execute( "PRAGMA read_uncommitted = 1" )
+                conn.execute( "PRAGMA query_only = 1" )
+                self._readers.append( conn )
+                if old is not None:
+                    self._readers.remove( old )
+                generation = self._generation
+            if old is not None:
+                old.close()
+            local.conn       = conn
+            local.generation = generation
+        return local.conn
+
+    def resync( self ):
+        '''
+        Copies the disk database into a new generation of the mirror.
+        '''
+        with self._lock:
+            if self._watch is None:
+                self._watch = sqlite3.connect( self.database, check_same_thread=False )
+            #=======================================================================================
+            # the data_version before the copy ... a change during the copy leads to another resync
+            #=======================================================================================
+            version    = self._watch.execute( "PRAGMA data_version" ).fetchone()[0]
+            generation = self._generation + 1
+            uri        = "file:webdemo_mirror_{0}_{1}?mode=memory&cache=shared".format( id( self ), generation )
+            writer     = sqlite3.connect( uri, uri=True, check_same_thread=False )
+            disk       = sqlite3.connect( self.database )
+            try:
+                disk.backup( writer )
+            finally:
+                disk.close()
+            writer.execute( "ATTACH DATABASE ? AS disk", ( self.database, ) )
+            old                 = self._writer
+            self._writer        = writer
+            self._uri           = uri
+            self._generation    = generation
+            self._watch_version = version
+            if old is not None:
+                old.close()
+        #===========================================================================================
+        # the caches may hold results of the old generation ( read after the disk has changed, but
+        # before this resync ), the new generation bumps their generations so they are dropped
+        #===========================================================================================
+        invalidate_all_caches()
+        self.bus.log( "MemoryMirror: generation {0} loaded".format( generation ) )
+
+    def reconcile( self ):
+        '''
+        Monitor callback ... a new generation, if the disk database has been changed by someone else.
+        '''
+        with self._lock:
+            if self._uri is None:
+                return
+            version = self._watch.execute( "PRAGMA data_version" ).fetchone()[0]
+            if version == self._watch_version:
+                return
+        self.resync()
+
+    def write_through( self, table_name, deleted=(), changed=() ):
+        '''
+        Applies a committed write of the disk database to the mirror: the rows with the rowids
+        in deleted are deleted, the rows with the rowids in changed are copied from disk.
+        '''
+        if not self.serves( table_name ):
+            return
+        table = quote_identifier( table_name )
+        try:
+            with self._lock:
+                names   = [ row[1] for row in self._writer.execute( "PRAGMA main.table_info({0})".format( table ) ) ]
+                columns = ", ".join( quote_identifier( name ) for name in names )
+                #===================================================================================
+                # the changed rows are updated in place ( not deleted and inserted again ), so the
+                # readers ( read_uncommitted ) never miss a row, which is still on disk
+                #===================================================================================
+                with self._writer:
+                    for batch in batches( list( deleted ) ):
+                        self._writer.execute( "delete from main.{0} where rowid in ( {1} )".format( table, ", ".join( "?" * len( batch ) ) ),
+                                              batch )
+                    for batch in batches( list( changed ) ):
+                        placeholders = ", ".join( "?" * len( batch ) )
+                        self._writer.execute( "update main.{0} as m set {1} from disk.{0} as d "
+                                              "where d.rowid = m.rowid and m.rowid in ( {2} )".format(
+                                                  table,
+                                                  ", ".join( "{0} = d.{0}".format( quote_identifier( name ) ) for name in names ),
+                                                  placeholders ),
+                                              batch )
+                        self._writer.execute( "insert into main.{0}( rowid, {1} ) select rowid, {1} from disk.{0} "
+                                              "where rowid in ( {2} ) and rowid not in ( select rowid from main.{0} "
+                                              "where rowid in ( {2} ) )".format( table, columns, placeholders ),
+                                              batch + batch )
+                        # deleted on disk in the meantime
+                        self._writer.execute( "delete from main.{0} where rowid in ( {1} ) and rowid not in "
+                                              "( select rowid from disk.{0} where rowid in ( {1} ) )".format( table, placeholders ),
+                                              batch + batch )
+                #===================================================================================
+                # our own commits have changed the data_version, but they are in the mirror now
+                #===================================================================================
+                self._watch_version = self._watch.execute( "PRAGMA data_version" ).fetchone()[0]
+        except sqlite3.Error as e:
+            logger.warning( "MemoryMirror: write through failed ({0}), resync".format( e ) )
+            self.resync()
+
+memory_mirror = MemoryMirror( cherrypy.engine, DB_STRING )
+memory_mirror.subscribe()
+
+def read_connections( table_name ):
+    '''
+    The connections for the grid reads of a table: the memory_mirror, if it serves the table.
+    '''
+    return memory_mirror if memory_mirror.serves( table_name ) else db_manager
 
 #===================================================================================================
-# gobal database definition
+# change feed ... incremental refresh of the grids
+# Triggers write each insert, update and delete of a tracked table into <table>_changes. The
+# version (autoincrement) of a change is the position in the feed. get_table_changes?since=<version>
+# returns the records changed after this version, as a long poll (wait=<seconds>) or as a stream
+# of Server-Sent Events (stream=1).
 #===================================================================================================
-current_dir = os.path.dirname( os.path.abspath( __file__ ) )
-DB_STRING   = os.path.join( current_dir, 'demo.db' )
+CHANGES_TABLES        = [ "test" ]   # tables with change tracking (created on the first request)
+CHANGES_RETENTION     = 100000       # changes we keep per table, older versions get a "reset"
+CHANGES_LIMIT         = 1000         # changed records per response
+CHANGES_MAX_WAIT      = 30.0         # maximum seconds of a long poll
+CHANGES_POLL_INTERVAL = 1.0          # seconds between two checks for changes of other processes
+CHANGES_MAX_WAITERS   = HTTP_THREAD_POOL // 2   # waiting requests, each of them blocks an HTTP thread
+CHANGES_SSE_DURATION  = 300.0        # seconds of an event stream, then the browser reconnects
+CHANGES_KEEPALIVE     = 15.0         # seconds between two comments of an idle event stream
+
+def changes_table_name( table_name ):
+    return table_name + "_changes"
+
+class ChangeTracker(object):
+    '''
+    Creates the change tables and triggers and wakes up the requests waiting for changes.
+
+    notify() is called after each write of this process ( see invalidate_table_caches ), the
+    writes of other processes are found by polling every CHANGES_POLL_INTERVAL seconds.
+    '''
+    def __init__( self, tables=CHANGES_TABLES, max_waiters=CHANGES_MAX_WAITERS ):
+        self.tables      = set( tables )
+        self.max_waiters = max_waiters
+        self._lock       = threading.Lock()
+        self._versions   = {}   # table --> schema_version, when we have checked the triggers
+        self._condition  = threading.Condition()
+        self._sequence   = 0
+        self._waiters    = 0
+
+    def ensure( self, conn, table_name ):
+        '''
+        Creates the change table and the triggers of a table (if they do not exist yet).
+
+        Raises a ValueError for an unknown table or a table without change tracking.
+        '''
+        schema_cache.columns( conn, table_name )
+        if table_name not in self.tables:
+            raise ValueError( "No change tracking for table: {0}".format( table_name ) )
+        with self._lock:
+            version = conn.execute( "PRAGMA schema_version" ).fetchone()[0]
+            if self._versions.get( table_name ) == version:
+                return
+            table   = quote_identifier( table_name )
+            changes = quote_identifier( changes_table_name( table_name ) )
+            trigger = lambda suffix: quote_identifier( "{0}_{1}".format( changes_table_name( table_name ), suffix ) )
+            with conn:
+                conn.execute( '''create table if not exists {0}( version   integer primary key autoincrement,
+                                                                 row_id    integer not null,
+                                                                 operation text    not null )'''.format( changes ) )
+                conn.execute( '''create trigger if not exists {0} after insert on {1} begin
+                                     insert into {2}( row_id, operation ) values( new.rowid, 'insert' );
+                                 end'''.format( trigger( "ai" ), table, changes ) )
+                conn.execute( '''create trigger if not exists {0} after update on {1} begin
+                                     insert into {2}( row_id, operation ) select old.rowid, 'delete' where old.rowid != new.rowid;
+                                     insert into {2}( row_id, operation ) values( new.rowid, 'update' );
+                                 end'''.format( trigger( "au" ), table, changes ) )
+                conn.execute( '''create trigger if not exists {0} after delete on {1} begin
+                                     insert into {2}( row_id, operation ) values( old.rowid, 'delete' );
+                                 end'''.format( trigger( "ad" ), table, changes ) )
+            self._versions[table_name] = conn.execute( "PRAGMA schema_version" ).fetchone()[0]
+
+    def sequence( self ):
+        with self._condition:
+            return self._sequence
+
+    def notify( self ):
+        with self._condition:
+            self._sequence += 1
+            self._condition.notify_all()
+
+    def wait( self, sequence, timeout ):
+        '''
+        Waits until notify() has been called after we got the sequence, or until the timeout.
+        '''
+        with self._condition:
+            self._condition.wait_for( lambda: self._sequence != sequence, timeout )
+
+    def enter( self ):
+        '''
+        Admission of a waiting request. Raises a DBBusyError if too many requests are waiting.
+        '''
+        with self._condition:
+            if self._waiters >= self.max_waiters:
+                raise DBBusyError( "Too many clients waiting for changes, please try again later" )
+            self._waiters += 1
+
+    def leave( self ):
+        with self._condition:
+            self._waiters -= 1
+
+change_tracker = ChangeTracker()
+
+def select_changes( conn, table_name, since, limit=CHANGES_LIMIT ):
+    '''
+    Returns the changes of a table after the version since:
+    {"status": "success", "version", "more", "inserted": [records], "updated": [records], "deleted": [recids]}
+
+    Several changes of a record are merged, a record inserted and deleted after since is not
+    returned at all. The version of the result is the since of the next call. Without since we
+    just return the current version. If the changes after since have been dropped already
+    ( CHANGES_RETENTION ), the status is "reset" and the client has to reload the grid.
+    '''
+    change_tracker.ensure( conn, table_name )
+    table   = quote_identifier( table_name )
+    changes = quote_identifier( changes_table_name( table_name ) )
+    #===============================================================================================
+    # drop the oldest changes ... in its own transaction, a read transaction of WAL can not be
+    # upgraded to a write, if someone else has committed in the meantime
+    #===============================================================================================
+    with conn:
+        first, last = conn.execute( "select min(version), max(version) from {0}".format( changes ) ).fetchone()
+        if first is not None and last - first >= CHANGES_RETENTION * 1.1:
+            conn.execute( "delete from {0} where version <= ?".format( changes ), ( last - CHANGES_RETENTION, ) )
+    #===============================================================================================
+    # the version and the changes are read in one read transaction ( one snapshot ), otherwise
+    # a commit between them returns changes behind the version and the next call again
+    #===============================================================================================
+    with conn:
+        conn.execute( "begin" )
+        row     = conn.execute( "select seq from sqlite_sequence where name = ?", ( changes_table_name( table_name ), ) ).fetchone()
+        current = row[0] if row else 0
+        first   = conn.execute( "select min(version) from {0}".format( changes ) ).fetchone()[0]
+        result = { "status": "success", "version": current, "more": False, "inserted": [], "updated": [], "deleted": [] }
+        if since is None:
+            return result
+        if since > current or ( since < current and ( first is None or since < first - 1 ) ):
+            return { "status": "reset", "version": current }
+        curs = InstrumentedCursor( conn.cursor() )
+        curs.execute( '''select c.version, f.operation, c.row_id, t.rowid, t.*
+                           from ( select row_id, min(version) as first_version, max(version) as version
+                                    from {0} where version > ? group by row_id order by version limit ? ) c
+                           join {0} f on f.version = c.first_version
+                           left join {1} t on t.rowid = c.row_id
+                          order by c.version'''.format( changes, table ), ( since, limit + 1 ), query="changes" )
+        columns = [ column[0] for column in curs.description ][3:]
+        rows    = curs.fetchall()
+        if len( rows ) > limit:
+            rows = rows[:limit]
+            result["more"]    = True
+            result["version"] = rows[-1][0]
+        for version, operation, row_id, *row in rows:
+            if row[0] is None:
+                # a record inserted after since and deleted again is not of interest
+                if operation != "insert":
+                    result["deleted"].append( row_id )
+            elif operation == "insert":
+                result["inserted"].append( grid_record( columns, row ) )
+            else:
+                result["updated"].append( grid_record( columns, row ) )
+    return result
+
+def engine_running():
+    # waiting requests stop on shutdown, otherwise the HTTP server has to wait for them
+    return cherrypy.engine.state == cherrypy.engine.states.STARTED
+
+def has_changes( result ):
+    return result["status"] != "success" or result["inserted"] or result["updated"] or result["deleted"]
+
+def wait_for_changes( table_name, since, wait ):
+    '''
+    select_changes() ... if there are no changes, we wait up to wait seconds for them.
+    '''
+    deadline = time.monotonic() + wait
+    waiting  = False
+    try:
+        while True:
+            sequence = change_tracker.sequence()
+            result   = db_executor.run( select_changes, table_name, since )
+            if since is None or has_changes( result ):
+                return result
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or not engine_running():
+                return result
+            if not waiting:
+                change_tracker.enter()
+                waiting = True
+            change_tracker.wait( sequence, min( remaining, CHANGES_POLL_INTERVAL ) )
+    finally:
+        if waiting:
+            change_tracker.leave()
+
+def stream_changes( table_name, since, first ):
+    '''
+    Generator for the Server-Sent Events of get_table_changes ... an event for each result with
+    changes (event "reset" for a reset), a comment to keep an idle connection alive.
+    '''
+    end    = time.monotonic() + CHANGES_SSE_DURATION
+    result = first
+    yield b"retry: 5000\n\n"
+    while True:
+        if has_changes( result ) or since is None:
+            event  = b"event: reset\n" if result["status"] == "reset" else b""
+            since  = result["version"]
+            yield event + "id: {0}\ndata: ".format( since ).encode() + dumps_json( result ) + b"\n\n"
+        else:
+            yield b": keepalive\n\n"
+        remaining = end - time.monotonic()
+        if remaining <= 0 or not engine_running():
+            return
+        try:
+            result = wait_for_changes( table_name, since, min( CHANGES_KEEPALIVE, remaining ) )
+        except ( ValueError, sqlite3.Error, DBExecutorError ):
+            # the browser reconnects with the last id after the retry time
+            return
+
+#===================================================================================================
+# export and import of whole tables
+# - export_table_rows streams the rows of a cursor as CSV or NDJSON, one chunk per fetchmany
+# - read_import_rows parses an uploaded file line by line, insert_records inserts one chunk of
+#   records with executemany ... so neither of them needs the whole table in memory
+#===================================================================================================
+EXPORT_CHUNK_SIZE = 1000   # rows per fetchmany and per chunk of the response
+IMPORT_CHUNK_SIZE = 5000   # records per executemany and per transaction
+IMPORT_MAX_BYTES  = 2 * 1024 * 1024 * 1024   # maximum size of an uploaded file (only import_table_data)
+REQUEST_MAX_BYTES = 100 * 1024 * 1024        # maximum size of the body of all other requests
+EXPORT_WORKERS    = 2      # exports running at the same time, more are rejected as busy
+EXPORT_FORMATS    = { "csv": "text/csv; charset=utf-8", "ndjson": "application/x-ndjson" }
+IMPORT_CONFLICTS  = { "abort": "insert", "ignore": "insert or ignore", "replace": "insert or replace" }
+
+#===================================================================================================
+# a download holds its job for the whole response, so the exports ( and the whole table of
+# get_table_data ) have their own executor and a slow client does not block the DB_WORKERS of
+# the grid requests
+#===================================================================================================
+export_executor = DBExecutor( cherrypy.engine, db_manager, workers=EXPORT_WORKERS, queue_limit=EXPORT_WORKERS,
+                              name="Export Worker" )
+export_executor.subscribe()
+
+def export_table_rows( conn, table_name, export_format, request ):
+    '''
+    Generator for the export of a table (all columns, without rowid) as CSV or NDJSON.
+
+    request may contain "search", "searchLogic" and "sort" of a w2ui grid, so we export the same
+    rows the grid shows. Each yielded chunk holds the rows of one fetchmany.
+    Raises a ValueError for an unknown table, field or format.
+    '''
+    if export_format not in EXPORT_FORMATS:
+        raise ValueError( "Unknown export format: {0}".format( export_format ) )
+    columns                = schema_cache.columns( conn, table_name )
+    fts_table, fts_columns = fts_search_table( conn, table_name )
+    where_clause, where_params = compile_search( request.get( 'search', [] ), request.get( 'searchLogic' ),
+                                                 columns, fts_table, fts_columns )
+    order_columns = compile_sort( request.get( 'sort', [] ), columns )
+    names     = list( columns )
+    statement = "select {0} from {1} {2} order by {3}".format( ", ".join( quote_identifier( name ) for name in names ),
+                                                               quote_identifier( table_name ),
+                                                               "where " + where_clause if where_clause else "",
+                                                               ", ".join( "{0} {1}".format( quote_identifier( column ), direction )
+                                                                          for column, direction in order_columns ) )
+    curs = InstrumentedCursor( conn.cursor() )
+    curs.execute( statement, where_params, query="export" )
+    try:
+        buffer = io.StringIO()
+        writer = csv.writer( buffer )
+        if export_format == "csv":
+            writer.writerow( names )
+        while True:
+            rows = curs.fetchmany( EXPORT_CHUNK_SIZE )
+            if not rows:
+                break
+            if export_format == "csv":
+                writer.writerows( rows )
+            else:
+                for row in rows:
+                    buffer.write( json.dumps( dict( zip( names, row ) ) ) )
+                    buffer.write( "\n" )
+            yield buffer.getvalue().encode( 'utf-8' )
+            buffer.seek( 0 )
+            buffer.truncate()
+        #===========================================================================================
+        # the header of an empty table
+        #===========================================================================================
+        if buffer.tell():
+            yield buffer.getvalue().encode( 'utf-8' )
+    finally:
+        curs.close()
+
+def read_import_rows( fp, import_format ):
+    '''
+    Generator for the records ( dicts ) of an uploaded CSV (with a header line) or NDJSON file.
+
+    The file is read line by line. Raises a ValueError for an unknown format or a bad line.
+    '''
+    if import_format not in EXPORT_FORMATS:
+        raise ValueError( "Unknown import format: {0}".format( import_format ) )
+    text = io.TextIOWrapper( fp, encoding='utf-8-sig', newline='' )
+    try:
+        if import_format == "csv":
+            reader = csv.DictReader( text )
+            for record in reader:
+                if None in record:
+                    raise ValueError( "Line {0}: more values than columns".format( reader.line_num ) )
+                yield record
+        else:
+            for line_number, line in enumerate( text, 1 ):
+                if not line.strip():
+                    continue
+                record = json.loads( line )
+                if not isinstance( record, dict ):
+                    raise ValueError( "Line {0}: a JSON object expected".format( line_number ) )
+                yield record
+    finally:
+        # do not close the uploaded file with our wrapper
+        text.detach()
+
+def chunked( iterable, chunk_size ):
+    chunk = []
+    for item in iterable:
+        chunk.append( item )
+        if len( chunk ) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def insert_records( conn, table_name, columns, records, conflict="abort" ):
+    '''
+    Inserts the records ( dicts ), records with the same set of fields share one executemany.
+
+    conflict is one of IMPORT_CONFLICTS: "abort" fails on a constraint violation, "ignore" skips
+    the record and "replace" replaces the existing record.
+    The caller is responsible for the transaction. Returns the number of inserted records.
+    Raises a ValueError for an unknown field or conflict.
+    '''
+    if conflict not in IMPORT_CONFLICTS:
+        raise ValueError( "Unknown conflict handling: {0}".format( conflict ) )
+    groups = collections.OrderedDict()
+    for record in records:
+        fields = tuple( record )
+        groups.setdefault( fields, [] ).append( [ record[field] for field in fields ] )
+    curs     = conn.cursor()
+    inserted = 0
+    for fields, rows in groups.items():
+        for field in fields:
+            if field not in columns:
+                raise ValueError( "Unknown field: {0}".format( field ) )
+        statement = "{0} into {1}( {2} ) values( {3} )".format( IMPORT_CONFLICTS[conflict],
+                                                               quote_identifier( table_name ),
+                                                               ", ".join( quote_identifier( field ) for field in fields ),
+                                                               ", ".join( "?" * len( fields ) ) )
+        curs.executemany( statement, rows )
+        inserted += curs.rowcount
+    return inserted
+
+#===================================================================================================
+# streaming of large grid results
+#===================================================================================================
+STREAM_GRID_DATA  = True   # stream the result of get_table_data instead of building one string
+STREAM_CHUNK_SIZE = 500    # number of rows fetched from the cursor for each chunk
+
+def stream_grid_records( curs, total_rows, chunk_size=STREAM_CHUNK_SIZE, columnar=False ):
+    '''
+    Generator for the w2ui grid structure {"status", "total", "records"}.
+
+    The rows are fetched with fetchmany, so that only one chunk of rows is in memory at the
+    same time. The envelope is written around the records piece by piece, the result is the
+    same as the serialization of the whole structure.
+    With columnar, we send the column names once and the rows as arrays (see grid_columns).
+    '''
+    try:
+        #===========================================================================================
+        # get all fields from the select ...
+        #===========================================================================================
+        columns = [column[0] for column in curs.description]
+        if columnar:
+            yield b'{"status": "success", "total": ' + str( total_rows ).encode() + \
+                  b', "columns": ' + dumps_json( grid_columns( columns ) ) + b', "rows": ['
+        else:
+            yield b'{"status": "success", "total": ' + str( total_rows ).encode() + b', "records": ['
+        separator = b""
+        while True:
+            data = curs.fetchmany( chunk_size )
+            if not data:
+                break
+            if columnar:
+                #===================================================================================
+                # one serializer call per chunk ... without the brackets of the list
+                #===================================================================================
+                yield separator + dumps_json( data )[1:-1]
+            else:
+                yield separator + b", ".join( dumps_json( grid_record( columns, row ) ) for row in data )
+            separator = b", "
+        yield b"]}"
+    finally:
+        curs.close()
+
+def grid_record( columns, row ):
+    '''
+    A row of "select rowid, <table>.* ..." as record of a w2ui grid.
+    '''
+    #===============================================================================================
+    # we need here an ordered dict so that we keep the column order of our selection ...
+    # note that a dict is not ordered and the the result would be randomly ordered!
+    #===============================================================================================
+    record = collections.OrderedDict( zip(columns, row) )
+    #===============================================================================================
+    # we need to add the record ID for the w2ui grid to the result
+    # ... we use here the sqlite rowid as an unique identifier since this will help us
+    # with all other operations like delete or update a record ...
+    #===============================================================================================
+    record["recid"] = row[0] #rowid
+    return record
+
+def grid_columns( columns ):
+    '''
+    Column names of the columnar format: the rowid (first column of our selects) is the recid.
+
+    The columnar format is {"status", "total", "columns": [...], "rows": [[...], ...]}, each
+    name is sent once instead of once per record. The client expands it, see database.html.
+    '''
+    return [ "recid" ] + columns[1:]
+
+#===================================================================================================
+# helper function for the keyset pagination
+#===================================================================================================
+def keyset_condition( order_columns, last_key ):
+    '''
+    Builds the seek condition for the rows behind last_key.
+
+    order_columns is a list of (column, direction) tuples, the last entry is always the rowid
+    so that the sort key is unique. For "a asc, rowid asc" the condition is
+
+        ( a > ? ) or ( a = ? and rowid > ? )
+
+    SQLite sorts NULL before all values, so with "desc" the NULLs come last and are behind any
+    last_key: "a desc" seeks with "( a < ? or a is null )". last_key never contains a NULL
+    (see select_grid_page), the first page and the pages behind a NULL use the offset.
+    Returns the sql text and the parameter list.
+    '''
+    conditions = []
+    params     = []
+    for i, ( column, direction ) in enumerate( order_columns ):
+        parts = []
+        for equal_column, _ in order_columns[:i]:
+            parts.append( "{0} = ?".format( quote_identifier( equal_column ) ) )
+        if direction == 'desc' and column != "rowid":
+            parts.append( "( {0} < ? or {0} is null )".format( quote_identifier( column ) ) )
+        else:
+            parts.append( "{0} {1} ?".format( quote_identifier( column ), '<' if direction == 'desc' else '>' ) )
+        conditions.append( "( " + " and ".join( parts ) + " )" )
+        params.extend( last_key[:i + 1] )
+    return ( " or ".join( conditions ), params )
 
 class HelloWorld(object):
     #===============================================================================================
@@ -73,100 +2430,93 @@ class HelloWorld(object):
     # /formular --> http://localhost:4444/formular
     #===============================================================================================
     @cherrypy.expose
+    @cherrypy.config( **PAGE_CONFIG )
     def formular(self):
-        with open( "formular.html", encoding='utf-8' ) as f:
-            html = f.read()
-        return html
+        return page_cache.serve( "formular.html" )
 
     @cherrypy.expose
     def submit_form(self, **kwargs):
-        print("form submit ...")
-        print( kwargs )
+        logger.info( "form submit ...", extra={ "fields": kwargs } )
         return f"form received ... {kwargs}"
 
     #===============================================================================================
     # /database --> http://localhost:4444/database
     #===============================================================================================
     @cherrypy.expose
+    @cherrypy.config( **PAGE_CONFIG )
     def database(self):
-        with open( "database.html", encoding='utf-8' ) as f:
-            html = f.read()
-        return html
+        return page_cache.serve( "database.html" )
 
     #===============================================================================================
     # /jquery-ui_sample --> http://localhost:4444/jquery-ui_sample
     #===============================================================================================
     @cherrypy.expose
+    @cherrypy.config( **PAGE_CONFIG )
     def jquery_ui_sample(self):
-        with open( "jquery-ui_sample.html", encoding='utf-8' ) as f:
-            html = f.read()
-        return html
+        return page_cache.serve( "jquery-ui_sample.html" )
 
     #===============================================================================================
     # /ajax_sample --> http://localhost:4444/ajax_sample
     #===============================================================================================
     @cherrypy.expose
+    @cherrypy.config( **PAGE_CONFIG )
     def ajax_sample(self):
-        with open( "ajax_sample.html", encoding='utf-8' ) as f:
-            html = f.read()
-        return html
+        return page_cache.serve( "ajax_sample.html" )
 
 
+    #===============================================================================================
+    # /assets --> fingerprinted static files, see AssetPipeline
+    #===============================================================================================
+    @cherrypy.expose
+    @cherrypy.config( **ASSET_CONFIG )
+    def assets( self, *path ):
+        return asset_pipeline.serve( "/".join( path ) )
+
     @cherrypy.expose
     def get_table_data( self, **kwargs ):
-        print("*** get_table_data ***")
         #===========================================================================================
-        # w2ui gives us already a lot of parameters ... check the print
+        # w2ui gives us already a lot of parameters ... check the log (level DEBUG)
         # we just ignore them in our sample
         #===========================================================================================
-        for arg, value in kwargs.items():
-            print( "*****************************************************************************" )
-            print( "Parameter: {0}, Value:{1}".format(arg, value) )
-            print( "*****************************************************************************" )
+        log_parameters( endpoint_logger( "get_table_data" ), kwargs )
 
         # hard coded in this simplified version of get_table_data
         table_name = "test"
+        #===========================================================================================
+        # the columnar format is opt-in: format=columnar or "format": "columnar" in the request
+        #===========================================================================================
+        try:
+            request = json.loads( kwargs.get( "request" ) or "{}" )
+        except ValueError:
+            request = {}
+        columnar = "columnar" in ( kwargs.get( "format" ), request.get( "format" ) )
 
-        with sqlite3.connect(DB_STRING) as conn:
-            curs = conn.cursor()
+        def select_table_data( conn ):
+            curs = InstrumentedCursor( conn.cursor() )
             #=======================================================================================
             # get the maximum of possible rows
             #=======================================================================================
-            curs.execute( "select count(*) from {0}".format( table_name ) )
+            curs.execute( "select count(*) from {0}".format( table_name ), query="count" )
             data = curs.fetchone()
             total_rows = data[0]
             #=======================================================================================
             # get the requested results ...
             #=======================================================================================
-            curs.execute(  "select rowid, {0}.* from {0}".format( table_name ) )
-            #=======================================================================================
-            # get all fields from the select ...
-            #=======================================================================================
-            columns = [column[0] for column in curs.description]
-            data = curs.fetchall()
-            records = []
-            for i, row in enumerate(data):
-                #===================================================================================
-                # we need here an ordered dict so that we keep the column order of our selection ...
-                # note that a dict is not ordered and the the result would be randomly ordered!
-                #===================================================================================
-                record = collections.OrderedDict( zip(columns, row) )
-                #===================================================================================
-                # we need to add the record ID for the w2ui grid to the result
-                # ... we use here the sqlite rowid as an unique identifier since this will help us
-                # with all other operations like delete or update a record ...
-                #===================================================================================
-                record["recid"] = row[0] #rowid
-                records.append(record)
-            #=======================================================================================
-            # build the final w2ui grid structure
-            #=======================================================================================
-            result = {
-                         "status":  "success",
-                         "total":   total_rows,
-                         "records": records
-                     }
-            return  json.dumps( result )
+            curs.execute(  "select rowid, {0}.* from {0}".format( table_name ), query="page" )
+            return stream_grid_records( curs, total_rows, columnar=columnar )
+        #===========================================================================================
+        # the response is streamed (see _cp_config below), so we return a generator.
+        # CherryPy writes each yielded chunk to the client, while the export executor fetches the
+        # next rows ( the whole table is a download, it must not hold a DB worker of the grids ).
+        #===========================================================================================
+        try:
+            return export_executor.stream( select_table_data, connections=read_connections( table_name ) )
+        except ( sqlite3.Error, DBExecutorError ) as e:
+            return w2ui_error( e )
+    #===============================================================================================
+    # switch on the streaming of the response body for get_table_data
+    #===============================================================================================
+    get_table_data._cp_config = { 'response.stream': STREAM_GRID_DATA }
 
     @cherrypy.expose
     def get_table_data_all( self, **kwargs ):
@@ -179,184 +2529,229 @@ class HelloWorld(object):
         #===========================================================================================
         # log all parameters
         #===========================================================================================
-        for arg, value in kwargs.items():
-            print( "Parameter: {0}, Value:{1}".format(arg, value) )
-        kwargs = json.loads(kwargs["request"])
+        log_parameters( endpoint_logger( "get_table_data_all" ), kwargs )
+        try:
+            kwargs = json.loads( kwargs.get( "request" ) or "{}" )
+            if not isinstance( kwargs, dict ):
+                raise ValueError( "Invalid request: {0!r}".format( kwargs ) )
+            #=======================================================================================
+            # get the table name
+            #=======================================================================================
+            table_name = kwargs.get( 'table_name' )
+            if not isinstance( table_name, str ):
+                raise ValueError( "Unknown table: {0}".format( table_name ) )
+        except ValueError as e:
+            return w2ui_error( e )
+
         #===========================================================================================
-        # get the table name
+        # the selection runs in our DB executor, not in the HTTP worker thread
+        # ( a sqlite3.Error e.g. for a view or a WITHOUT ROWID table, they have no rowid )
         #===========================================================================================
-        table_name = kwargs.get( 'table_name' )
-
-        with sqlite3.connect(DB_STRING) as conn:
-            curs = conn.cursor()
-            #===========================================================================================
-            # check if we do have some search filters --> WHERE clause for our select statement
-            #===========================================================================================
-            i = 0
-            where_clause = ""
-            for search in  kwargs.get( 'search', '' ):
-                current_field    = search.get( 'field' )
-                current_operator = search.get( 'operator' )
-                current_value    = search.get( "value" )
-                search_logic     = kwargs.get( 'searchLogic' )
-                print( "Search operation: field( {0} ) - operator ( {1} ) - search logic ( {2} )".format( current_field, current_operator, search_logic ) )
-                #=======================================================================================
-                # get type of field ...
-                # we need this so that we can create a correct SQL statement
-                #=======================================================================================
-                curs.execute( 'SELECT typeof({0}) FROM {1} LIMIT 1'.format( current_field, table_name ) )
-                data = curs.fetchone()
-                field_type = data[0].upper()
-                print( "Search operation: field type( {0} ) ".format( field_type ) )
-                #=======================================================================================
-                # kind of operation depending on the field type...
-                #=======================================================================================
-                #=======================================================================================
-                # text field operations ....
-                #=======================================================================================
-                if( field_type in ("TEXT", "BLOB") ):
-                    #===================================================================================
-                    # =
-                    #===================================================================================
-                    if( current_operator == "is" ):
-                        sql_operation = " {0} = '{1}'".format( current_field, current_value )
-                    #===================================================================================
-                    # like abc%
-                    #===================================================================================
-                    elif( current_operator == "begins" ):
-                        sql_operation = " {0} like '{1}%'".format( current_field, current_value )
-                    #===================================================================================
-                    # like %abc%
-                    #===================================================================================
-                    elif( current_operator == "contains" ):
-                        sql_operation = " {0} like '%{1}%'".format( current_field, current_value )
-                    #===================================================================================
-                    # like %abc
-                    #===================================================================================
-                    elif( current_operator == "ends" ):
-                        sql_operation = " {0} like '%{1}'".format( current_field, current_value )
-                    #===================================================================================
-                    # error
-                    #===================================================================================
-                    else:
-                        message = "Fatal Error: Unknown search operator: {0} (TEXT, BLOB)".format( current_operator )
-                        logger.critical( message )
-                        result = {
-                                    "status"  : "error",
-                                    "message" : message
-                                }
-                        return  json.dumps(result)
-                #=======================================================================================
-                # numbers ...
-                #=======================================================================================
-                elif( field_type in ("INTEGER", "FLOAT", "REAL") ):
-                    break
-                    # not implemented yet
-
-                #=======================================================================================
-                # build where clause ...
-                #=======================================================================================
-                if( i == 0 ):
-                    where_clause = ( "where " + sql_operation )
-                else:
-                    where_clause = ( where_clause + ' ' + search_logic + sql_operation )
-                i += 1
-            #===========================================================================================
-            # check if we do have a sorting in the request --> ORDER BY for our select statement
-            #===========================================================================================
-            i = 0
-            order_by = ""
-
-            # not implemented yet
-
-            #===========================================================================================
-            # get the maximum of possible rows
-            #===========================================================================================
-            print("TTTTTTTTTTTTTTTTTTTTTTTTT")
-            print( "select count(*) from {0} {1} {2}".format( table_name, where_clause, order_by ) )
-            print("TTTTTTTTTTTTTTTTTTTTTTTTT")
-            curs.execute( "select count(*) from {0} {1} {2}".format( table_name,
-                                                                    where_clause,
-                                                                    order_by ) )
-            data = curs.fetchone()
-            total_rows = data[0]
-            #===========================================================================================
-            # get the requested results ...
-            #===========================================================================================
-            curs.execute( "select rowid, {0}.* from {0} {1} {2} limit {3} offset {4}".format( table_name,
-                                                                                            where_clause,
-                                                                                            order_by,
-                                                                                            kwargs.get('limit'),
-                                                                                            kwargs.get('offset') ) )
-            #===========================================================================================
-            # get all fields from the select ...
-            #===========================================================================================
-            columns = [column[0] for column in curs.description]
-            data = curs.fetchall()
-            records = []
-            for i, row in enumerate(data):
-                #=======================================================================================
-                # we need here an ordered dict so that we keep the column order of our selection ...
-                # note that a dict is not ordered and the the result would be random ..
-                #=======================================================================================
-                record = collections.OrderedDict( zip(columns, row) )
-                #=======================================================================================
-                # we need to add the record ID for the w2ui grid to the result
-                # ... we use here the sqlite rowid as an unique identifier since this will help us
-                # with all other operations like delete or update a record ...
-                #=======================================================================================
-                record["recid"] = row[0] #rowid
-                records.append(record)
-            #===========================================================================================
-            # build the final w2ui grid structure
-            #===========================================================================================
-            result = {
-                        "status": "success",
-                        "total": total_rows,
-                        "records": records
-                    }
-            return  json.dumps( result )
+        try:
+            return db_executor.run( select_grid_page, table_name, kwargs,
+                                    connections=read_connections( table_name ) )
+        except ( sqlite3.Error, DBExecutorError ) as e:
+            return w2ui_error( e )
 
     @cherrypy.expose
     def delete_table_data( self, **kwargs ):
-        print("*** delete_table_data ***")
-        #===========================================================================================
-        # w2ui gives us already a lot of parameters ... check the print
-        # we just ignore them in our sample
-        #===========================================================================================
-        for arg, value in kwargs.items():
-            print( "*****************************************************************************" )
-            print( "Parameter: {0}, Value:{1}".format(arg, value) )
-            print( "*****************************************************************************" )
-
-        #TODO implement the record deletion here like this:
-        # kwargs = json.loads(kwargs["request"])
-        # recids = kwargs.get("recid")
-        # print( f"recids: {recids}" )
-        # with sqlite3.connect(DB_STRING) as conn:
-        #     curs = conn.cursor()
-        #     for recid in recids:
-        #         curs.execute(f"delete from test where rowid = {recid}")
-        #     curs.execute("commit")
-        # result = { "status": "success" }
-        # return  json.dumps( result )
-
-        print( "deletion is not implemented yet!!!!" )
-        result = {
-                    "status":  "error",
-                    "message": "deletion is not implemented yet"
-                 }
+        '''
+        Deletes the selected records of our grid.
+
+        w2ui sends the rowids of the selected records in "recid". All records are deleted with a
+        few "rowid in (...)" statements in one transaction, so we need just one commit.
+        '''
+        log = endpoint_logger( "delete_table_data" )
+        log_parameters( log, kwargs )
+        kwargs     = json.loads(kwargs["request"])
+        table_name = kwargs.get( "table_name" )
+        recids     = kwargs.get( "recid" ) or []
+
+        def delete( conn ):
+            schema_cache.columns( conn, table_name )
+            #=======================================================================================
+            # one transaction for all batches ... a rollback on any error
+            #=======================================================================================
+            with conn:
+                deleted = delete_records( conn, table_name, recids )
+            db_manager.note_own_write()
+            memory_mirror.write_through( table_name, deleted=recids )
+            return deleted
+        try:
+            recids  = [ int( recid ) for recid in recids ]
+            deleted = db_executor.run( delete )
+        except ( ValueError, TypeError, sqlite3.Error, DBExecutorError ) as e:
+            return w2ui_error( e )
+        invalidate_table_caches( table_name )
+        log.info( "{0} record(s) deleted".format( deleted ), extra={ "fields": { "table": table_name } } )
+        result = { "status": "success" }
+        return  json.dumps( result )
+
+    @cherrypy.expose
+    def save_table_data( self, **kwargs ):
+        '''
+        Saves the changes of our grid.
+
+        w2ui sends all changed records in "changes". They are upserted in one transaction, so we
+        need just one commit for all changes.
+        '''
+        log = endpoint_logger( "save_table_data" )
+        log_parameters( log, kwargs )
+        try:
+            kwargs = json.loads( kwargs.get( "request" ) or "{}" )
+            if not isinstance( kwargs, dict ):
+                raise ValueError( "Invalid request: {0!r}".format( kwargs ) )
+            table_name = kwargs.get( "table_name" )
+            if not isinstance( table_name, str ):
+                raise ValueError( "Unknown table: {0}".format( table_name ) )
+            changes = validate_changes( kwargs.get( "changes" ) or [] )
+        except ValueError as e:
+            return w2ui_error( e )
+
+        def save( conn ):
+            columns = schema_cache.columns( conn, table_name )
+            #=======================================================================================
+            # one transaction for all changes ... a rollback on any error
+            #=======================================================================================
+            with conn:
+                affected = save_records( conn, table_name, columns, changes )
+            db_manager.note_own_write()
+            memory_mirror.write_through( table_name, changed=affected )
+            return affected
+        try:
+            affected = db_executor.run( save )
+        except ( ValueError, sqlite3.Error, DBExecutorError ) as e:
+            return w2ui_error( e )
+        invalidate_table_caches( table_name )
+        log.info( "{0} record(s) saved".format( len( affected ) ), extra={ "fields": { "table": table_name } } )
+        result = { "status": "success" }
         return  json.dumps( result )
 
+    @cherrypy.expose
+    def get_table_changes( self, table_name="test", since=None, wait=0, stream=None ):
+        '''
+        Returns the records inserted, updated and deleted after the version since (see
+        select_changes). Without since you get the current version to start with.
+
+        wait=<seconds> waits up to CHANGES_MAX_WAIT seconds for changes (long poll),
+        stream=1 sends the changes as Server-Sent Events (text/event-stream).
+        '''
+        # EventSource sends the id of the last event when it reconnects
+        since = cherrypy.request.headers.get( "Last-Event-ID", since )
+        try:
+            since = int( since ) if since not in ( None, "" ) else None
+            wait  = max( 0.0, min( float( wait ), CHANGES_MAX_WAIT ) )
+            first = wait_for_changes( table_name, since, 0 if stream else wait )
+        except ( ValueError, sqlite3.Error, DBExecutorError ) as e:
+            return w2ui_error( e )
+        if stream:
+            cherrypy.response.headers["Content-Type"]  = "text/event-stream"
+            cherrypy.response.headers["Cache-Control"] = "no-cache"
+            return stream_changes( table_name, since, first )
+        return dumps_json( first )
+    get_table_changes._cp_config = { 'response.stream': True }
+
+    @cherrypy.expose
+    def export_table_data( self, table_name="test", format="csv", request=None ):
+        '''
+        Exports a table as CSV or NDJSON file.
+
+        The response is streamed, the rows are fetched in chunks from the cursor in the
+        export_executor. An optional request ( JSON of a w2ui grid request ) filters and sorts the rows.
+        '''
+        log = endpoint_logger( "export_table_data" )
+        try:
+            request = json.loads( request ) if request else {}
+            body    = export_executor.stream( export_table_rows, table_name, format, request,
+                                              connections=read_connections( table_name ) )
+        except ( ValueError, sqlite3.Error, DBExecutorError ) as e:
+            return w2ui_error( e )
+        log.info( "export", extra={ "fields": { "table": table_name, "format": format } } )
+        cherrypy.response.headers['Content-Type']        = EXPORT_FORMATS[format]
+        cherrypy.response.headers['Content-Disposition'] = 'attachment; filename="{0}.{1}"'.format( table_name, format )
+        return body
+    export_table_data._cp_config = { 'response.stream': True }
+
+    @cherrypy.expose
+    def import_table_data( self, table_name="test", upload=None, format=None, conflict="abort" ):
+        '''
+        Imports an uploaded CSV (with a header line) or NDJSON file into a table.
+
+        CherryPy spools the upload into a temporary file, we parse it line by line and insert
+        IMPORT_CHUNK_SIZE records per transaction. The response is streamed, a NDJSON line for
+        each committed chunk and a final line with the status. On an error the chunks before
+        stay committed, the last line tells how many rows have been imported.
+        '''
+        log = endpoint_logger( "import_table_data" )
+        if upload is None:
+            return w2ui_error( "No file uploaded" )
+        if isinstance( upload, str ):
+            # a plain form field instead of a file
+            fp = io.BytesIO( upload.encode( 'utf-8' ) )
+        else:
+            fp = upload.file if upload.file is not None else io.BytesIO( upload.value )
+            if format is None and upload.filename:
+                format = { ".csv": "csv", ".ndjson": "ndjson", ".jsonl": "ndjson" }.get( os.path.splitext( upload.filename )[1].lower() )
+        format = format or "csv"
+        try:
+            columns = db_executor.run( schema_cache.columns, table_name )
+            if format not in EXPORT_FORMATS or conflict not in IMPORT_CONFLICTS:
+                raise ValueError( "Unknown format or conflict handling: {0}, {1}".format( format, conflict ) )
+        except ( ValueError, sqlite3.Error, DBExecutorError ) as e:
+            return w2ui_error( e )
+
+        def insert_chunk( conn, records ):
+            with conn:
+                inserted = insert_records( conn, table_name, columns, records, conflict )
+            db_manager.note_own_write()
+            return inserted
+
+        def progress():
+            chunk_number = 0
+            total        = 0
+            try:
+                for records in chunked( read_import_rows( fp, format ), IMPORT_CHUNK_SIZE ):
+                    chunk_number += 1
+                    try:
+                        total += db_executor.run( insert_chunk, records )
+                    finally:
+                        invalidate_table_caches( table_name )
+                    log.info( "chunk imported", extra={ "fields": { "table": table_name, "chunk": chunk_number, "rows": total } } )
+                    yield json.dumps( { "status": "progress", "chunk": chunk_number, "rows": total } ).encode( 'utf-8' ) + b"\n"
+            except ( ValueError, csv.Error, sqlite3.Error, DBExecutorError ) as e:
+                log.error( "import failed", extra={ "fields": { "table": table_name, "chunk": chunk_number, "error": str( e ) } } )
+                result = { "status": "error", "message": "Fatal Error: {0}".format( e ), "chunk": chunk_number, "rows": total }
+            else:
+                result = { "status": "success", "chunks": chunk_number, "rows": total }
+            #=======================================================================================
+            # the imported rows are not written through, the memory_mirror needs a new generation
+            #=======================================================================================
+            if total and memory_mirror.serves( table_name ):
+                memory_mirror.resync()
+            yield json.dumps( result ).encode( 'utf-8' ) + b"\n"
+        cherrypy.response.headers['Content-Type'] = 'application/x-ndjson'
+        return progress()
+    import_table_data._cp_config = { 'response.stream': True, 'request.body.maxbytes': IMPORT_MAX_BYTES }
+
+    @cherrypy.expose
+    def metrics( self ):
+        '''
+        All metrics in the Prometheus text format.
+        '''
+        cherrypy.response.headers['Content-Type'] = 'text/plain; version=0.0.4; charset=utf-8'
+        return metrics.render()
+
+    @cherrypy.expose
+    def get_cache_stats( self ):
+        '''
+        Hit and miss counters of our grid result cache.
+        '''
+        return  json.dumps( result_cache.stats() )
 
     @cherrypy.expose
     def string_reverse( self, string_to_reverse ):
-        print( "*****************************************************************************" )
-        print( "*** string_reverse ***" )
-        print( "*****************************************************************************" )
-        print( " String to reverse: {}".format( string_to_reverse ) )
+        log = endpoint_logger( "string_reverse" )
         if ( string_to_reverse.strip() == "" ):
-            print("bin hier ...")
             result_string = string_to_reverse[::-1]
             result = {
                         "status":  "bad",
@@ -368,10 +2763,140 @@ class HelloWorld(object):
                         "status":  "good",
                         "result":  result_string
                      }
-        print( " Result           : {}".format( result_string ) )
-        print( "*****************************************************************************" )
+        if log.isEnabledFor( logging.DEBUG ):
+            log.debug( "string reversed", extra={ "fields": { "string" : string_to_reverse,
+                                                              "result" : result_string } } )
         return  json.dumps( result )
 
+#===================================================================================================
+# data selection for get_table_data_all
+#===================================================================================================
+def select_grid_page( conn, table_name, kwargs ):
+    '''
+    Selects one page of a table for our grid and returns the serialized w2ui grid structure.
+
+    kwargs is the w2ui request (search, searchLogic, sort, limit, offset).
+    '''
+    with conn:
+        #===========================================================================================
+        # do we have this response in our cache already? A write of another connection
+        # (another thread or another process) drops the whole cache.
+        #===========================================================================================
+        if db_manager.data_version_changed():
+            invalidate_all_caches()
+        cache_key  = result_cache.key( table_name, kwargs )
+        body       = result_cache.get( cache_key )
+        if body is not None:
+            return body
+        generation        = result_cache.generation( table_name )
+        paging_generation = paging_cache.generation( table_name )
+        curs = InstrumentedCursor( conn.cursor() )
+        #===========================================================================================
+        # check the table and get the types of its columns from our schema cache
+        # check if we do have some search filters --> WHERE clause for our select statement
+        # check if we do have a sorting in the request --> ORDER BY for our select statement
+        #===========================================================================================
+        try:
+            table_columns          = schema_cache.columns( conn, table_name )
+            fts_table, fts_columns = fts_search_table( conn, table_name )
+            where_clause, where_params = compile_search( kwargs.get( 'search', [] ),
+                                                         kwargs.get( 'searchLogic' ),
+                                                         table_columns,
+                                                         fts_table,
+                                                         fts_columns )
+            order_columns = compile_sort( kwargs.get( 'sort', [] ), table_columns )
+            limit         = int( kwargs.get( 'limit', 100 ) )
+            offset        = int( kwargs.get( 'offset', 0 ) )
+            if limit < 0 or offset < 0:
+                raise ValueError( "Invalid limit or offset: {0}, {1}".format( limit, offset ) )
+        except ( ValueError, TypeError ) as e:
+            return  w2ui_error( e )
+        where_clause = paging_cache.normalize( where_clause )
+        table_sql    = quote_identifier( table_name )
+        #===========================================================================================
+        # let the index advisor know which columns we use ... it creates the indexes for the
+        # columns that are used most often in the background (always on the disk database,
+        # a memory_mirror gets the new indexes with its next resync)
+        #===========================================================================================
+        index_advisor.record( table_name, table_columns, kwargs.get( 'search', [] ), order_columns )
+        order_by = "order by " + ", ".join( "{0} {1}".format( quote_identifier( column ), direction )
+                                            for column, direction in order_columns )
+        #===========================================================================================
+        # get the maximum of possible rows ... cached until the next write to the table
+        #===========================================================================================
+        total_rows = paging_cache.get_count( table_name, where_clause, where_params )
+        if total_rows is None:
+            statement = "select count(*) from {0} {1}".format( table_sql,
+                                                               "where " + where_clause if where_clause else "" )
+            endpoint_logger( "sql" ).debug( statement )
+            curs.execute( statement, where_params, query="count" )
+            data = curs.fetchone()
+            total_rows = data[0]
+            paging_cache.set_count( table_name, where_clause, where_params, total_rows, paging_generation )
+        #===========================================================================================
+        # get the requested results ...
+        # if we know the sort key of the last row of the previous page, we seek behind it
+        # (keyset pagination). Otherwise we have to use an offset.
+        #===========================================================================================
+        last_key = None
+        if( offset > 0 ):
+            last_key = paging_cache.get_boundary( table_name, where_clause, where_params, order_by, offset )
+        conditions = [ "( " + where_clause + " )" ] if where_clause else []
+        params     = list( where_params )
+        if( last_key is not None ):
+            seek_condition, seek_params = keyset_condition( order_columns, last_key )
+            conditions.append( "( " + seek_condition + " )" )
+            params.extend( seek_params )
+            page_offset = 0
+        else:
+            page_offset = offset
+        statement = "select rowid, {0}.* from {0} {1} {2} limit ? offset ?".format( table_sql,
+                                                                                   "where " + " and ".join( conditions ) if conditions else "",
+                                                                                   order_by )
+        endpoint_logger( "sql" ).debug( statement )
+        curs.execute( statement, params + [ limit, page_offset ], query="page" )
+        #===========================================================================================
+        # get all fields from the select ...
+        #===========================================================================================
+        columns = [column[0] for column in curs.description]
+        data = curs.fetchall()
+        #===========================================================================================
+        # remember the sort key of the last row for the next page
+        # (a NULL in the sort key can not be used for a seek). The rowid is always the first
+        # column; for an INTEGER PRIMARY KEY SQLite names it after the alias (e.g. "id", "id"),
+        # so we search the sort columns behind it.
+        #===========================================================================================
+        if data:
+            last_row = data[-1]
+            next_key = tuple( last_row[0] if column == "rowid" else last_row[ columns.index( column, 1 ) ]
+                              for column, _ in order_columns )
+            if None not in next_key:
+                paging_cache.set_boundary( table_name, where_clause, where_params, order_by,
+                                           offset + len( data ), next_key, paging_generation )
+        #===========================================================================================
+        # build the final w2ui grid structure ... in the columnar format the rows are serialized
+        # as they come from the cursor, otherwise we need a record for each row
+        #===========================================================================================
+        if kwargs.get( 'format' ) == "columnar":
+            result = {
+                        "status": "success",
+                        "total": total_rows,
+                        "columns": grid_columns( columns ),
+                        "rows": data
+                    }
+        else:
+            with stage_timer( "rows" ):
+                records = [ grid_record( columns, row ) for row in data ]
+            result = {
+                        "status": "success",
+                        "total": total_rows,
+                        "records": records
+                    }
+        with stage_timer( "serialize" ):
+            body = dumps_json( result )
+        result_cache.put( cache_key, body, generation )
+        return  body
+
 #===================================================================================================
 # helper function to setup our little test database
 #===================================================================================================
@@ -379,7 +2904,7 @@ def setup_database():
     '''
     creates a table in our demo database
     '''
-    print("*** setup_database ***")
+    logger.info( "*** setup_database ***" )
 
     with sqlite3.connect(DB_STRING) as conn:
         curs = conn.cursor()
@@ -398,9 +2923,9 @@ def setup_database():
 
         curs.execute( "SELECT * FROM test" )
         names = curs.fetchall()
-        print("List of content in our test table")
+        logger.info( "List of content in our test table" )
         for name in names:
-            print(name)
+            logger.info( name )
 
 
 #===================================================================================================
@@ -410,10 +2935,16 @@ def cleanup_database():
     '''
     Destroy the test table from the database on server shutdown.
     '''
-    print("*** cleanup_database ***")
+    logger.info( "*** cleanup_database ***" )
 
     with sqlite3.connect(DB_STRING) as conn:
         curs = conn.cursor()
+        # the FTS5 shadow table of the index advisor (the indexes and triggers are dropped with the table)
+        statement = '''DROP TABLE IF EXISTS test_fts'''
+        curs.execute( statement )
+        # the change feed (the triggers are dropped with the table)
+        statement = '''DROP TABLE IF EXISTS test_changes'''
+        curs.execute( statement )
         statement = '''DROP TABLE test'''
         curs.execute( statement )
 
@@ -467,17 +2998,41 @@ app_conf = {
         }
 
 #===================================================================================================
-# set port to 4444
+# build fingerprinted and precompressed copies of all static files of our app configuration
+# on start, the html pages reference them instead of the plain urls
+#===================================================================================================
+asset_pipeline = AssetPipeline( cherrypy.engine,
+                                { url: conf['tools.staticfile.filename'] for url, conf in app_conf.items()
+                                  if 'tools.staticfile.filename' in conf },
+                                os.path.join( current_dir, "public", "dist" ),
+                                app_conf['/images']['tools.staticdir.dir'] )
+asset_pipeline.subscribe()
+page_cache.rewrite = asset_pipeline.rewrite_urls
+cherrypy.engine.subscribe( 'start', page_cache.clear )
+
+#===================================================================================================
+# set port to 4444, the number of HTTP worker threads and the maximum size of a request body
+# (the server allows an upload of IMPORT_MAX_BYTES, all handlers except import_table_data
+# reject a body larger than REQUEST_MAX_BYTES)
+#===================================================================================================
+cherrypy.config.update( { 'server.socket_port'           : 4444,
+                          'server.thread_pool'           : HTTP_THREAD_POOL,
+                          'server.max_request_body_size' : IMPORT_MAX_BYTES,
+                          'request.body.maxbytes'        : REQUEST_MAX_BYTES } )
+
+#===================================================================================================
+# measure all requests, see /metrics
 #===================================================================================================
-cherrypy.config.update( { 'server.socket_port'  : 4444 } )
+cherrypy.config.update( { 'tools.metrics.on' : True } )
 
 #===================================================================================================
 # use compression for some MIME types ...
+# (no images, jpeg/png/gif are compressed already and x-icon files are tiny)
 #===================================================================================================
 cherrypy.config.update( { 'tools.gzip.on'         : True,
                           'tools.gzip.mime_types' : ['text/html', 'text/plain', 'text/css', 'text/javascript',
-                                                     'image/jpeg', 'image/png', 'image/x-icon', 'image/gif',
-                                                     'application/javascript', 'application/json'] } )
+                                                     'application/javascript', 'application/json',
+                                                     'text/csv', 'application/x-ndjson'] } )
 #===================================================================================================
 # set cache settings
 #===================================================================================================
@@ -490,9 +3045,145 @@ cache_config = {
 }
 cherrypy.config.update( cache_config )
 
-cherrypy.engine.subscribe('start', setup_database)
-cherrypy.engine.subscribe('stop', cleanup_database)
+#===================================================================================================
+# multi-process mode ...
+# One Python process is limited to one core by the GIL. With --workers N a supervisor process
+# creates the listening socket, runs setup_database and starts N worker processes. Each worker
+# gets the socket as file descriptor 3 and LISTEN_PID in its environment. This is the systemd
+# socket activation of cheroot and CherryPy: they use the inherited socket instead of binding
+# the port themselves. The kernel hands each new connection to one of the workers.
+# The workers share demo.db in WAL mode, their caches check the data_version of the database.
+# Note: the caches and the /metrics are per worker process.
+#===================================================================================================
+LISTEN_FD_ENV        = "WEBDEMO_LISTEN_FD"
+WORKER_POLL_INTERVAL = 0.5    # seconds between two checks of the workers
+WORKER_MIN_UPTIME    = 5.0    # a worker dying faster than this is restarted with a delay ...
+WORKER_RESTART_DELAY = 2.0    # ... so a broken worker does not restart in a tight loop
+WORKER_STOP_TIMEOUT  = 15.0   # seconds for a graceful stop before we kill a worker
+
+class WorkerSupervisor(object):
+    '''
+    Starts the worker processes on a shared listening socket and restarts dead workers.
+    '''
+    def __init__( self, workers, host, port, backlog, worker_args=() ):
+        self.workers     = workers
+        self.worker_args = list( worker_args )
+        self.host        = host
+        self.port        = port
+        self.backlog     = backlog
+        self.socket      = None
+        self.children    = {}   # slot --> ( Popen, start time )
+        self.stopping    = False
+
+    def _spawn( self, slot ):
+        env = dict( os.environ )
+        env[LISTEN_FD_ENV] = str( self.socket.fileno() )
+        process = subprocess.Popen( [ sys.executable, os.path.abspath( __file__ ), "--worker" ] + self.worker_args,
+                                    env=env, pass_fds=( self.socket.fileno(), ) )
+        logger.info( "worker started", extra={ "fields": { "slot": slot, "pid": process.pid } } )
+        self.children[slot] = ( process, time.monotonic() )
+
+    def _stop( self, signum=None, frame=None ):
+        self.stopping = True
+
+    def run( self ):
+        self.socket = socket.socket( socket.AF_INET, socket.SOCK_STREAM )
+        self.socket.setsockopt( socket.SOL_SOCKET, socket.SO_REUSEADDR, 1 )
+        self.socket.bind( ( self.host, self.port ) )
+        self.socket.listen( self.backlog )
+        for signum in ( signal.SIGTERM, signal.SIGINT ):
+            signal.signal( signum, self._stop )
+        setup_database()
+        try:
+            for slot in range( self.workers ):
+                self._spawn( slot )
+            logger.info( "supervisor serving on http://{0}:{1} with {2} workers".format( self.host, self.port, self.workers ) )
+            #=======================================================================================
+            # restart dead workers
+            #=======================================================================================
+            restart_at = {}
+            while not self.stopping:
+                time.sleep( WORKER_POLL_INTERVAL )
+                for slot, ( process, started ) in list( self.children.items() ):
+                    if process.poll() is None:
+                        continue
+                    if slot not in restart_at:
+                        uptime = time.monotonic() - started
+                        logger.warning( "worker died", extra={ "fields": { "slot": slot, "pid": process.pid,
+                                                                          "returncode": process.returncode,
+                                                                          "uptime": round( uptime, 1 ) } } )
+                        restart_at[slot] = time.monotonic() + ( WORKER_RESTART_DELAY if uptime < WORKER_MIN_UPTIME else 0 )
+                    if time.monotonic() >= restart_at[slot] and not self.stopping:
+                        del restart_at[slot]
+                        self._spawn( slot )
+        finally:
+            self.shutdown()
+
+    def shutdown( self ):
+        '''
+        Stops all workers (SIGTERM lets CherryPy stop gracefully), then cleans up the database once.
+        '''
+        for process, _ in self.children.values():
+            if process.poll() is None:
+                process.terminate()
+        deadline = time.monotonic() + WORKER_STOP_TIMEOUT
+        for process, _ in self.children.values():
+            try:
+                process.wait( max( deadline - time.monotonic(), 0 ) )
+            except subprocess.TimeoutExpired:
+                process.kill()
+                process.wait()
+        self.children = {}
+        if self.socket is not None:
+            self.socket.close()
+            self.socket = None
+        cleanup_database()
+
+def run_worker():
+    '''
+    Runs a worker process of the WorkerSupervisor on the inherited socket.
+    '''
+    fd = int( os.environ[LISTEN_FD_ENV] )
+    if fd != 3:
+        #===========================================================================================
+        # cheroot expects the inherited socket as file descriptor 3
+        #===========================================================================================
+        try:
+            os.fstat( 3 )
+        except OSError:
+            os.dup2( fd, 3 )
+            os.close( fd )
+        else:
+            raise RuntimeError( "File descriptor 3 is in use, can not inherit the listening socket" )
+    os.environ['LISTEN_PID'] = str( os.getpid() )
+    # the supervisor restarts us, not the autoreloader
+    cherrypy.config.update( { 'engine.autoreload.on' : False } )
+    cherrypy.quickstart( HelloWorld(), config=app_conf )
+
 #===================================================================================================
 # start Web-Server ...
+# (only if we are started as a script, benchmark.py imports this module and starts the app itself)
 #===================================================================================================
-cherrypy.quickstart( HelloWorld(), config=app_conf )
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser( description="nemetris simple webapp demo" )
+    parser.add_argument( "--workers", type=int, default=1, help="number of worker processes (default 1)" )
+    parser.add_argument( "--mirror",  action="store_true", help="serve the grid reads from an in-memory mirror" )
+    parser.add_argument( "--worker",  action="store_true", help=argparse.SUPPRESS )
+    args = parser.parse_args()
+    memory_mirror.enabled = memory_mirror.enabled or args.mirror
+    if args.worker:
+        run_worker()
+    elif args.workers > 1 and os.name == "posix":
+        log_queue.start()
+        try:
+            WorkerSupervisor( args.workers, cherrypy.server.socket_host, cherrypy.server.socket_port,
+                              cherrypy.server.socket_queue_size, [ "--mirror" ] if args.mirror else [] ).run()
+        finally:
+            log_queue.stop()
+    else:
+        if args.workers > 1:
+            # no inheritance of sockets on Windows
+            logger.warning( "--workers is not supported on this platform, starting one process" )
+        cherrypy.engine.subscribe('start', setup_database)
+        cherrypy.engine.subscribe('stop', cleanup_database)
+        cherrypy.quickstart( HelloWorld(), config=app_conf )
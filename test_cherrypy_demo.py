@@ -0,0 +1,305 @@
+'''
+Regression tests for the grid endpoints of cherrypy_demo.py ... run them with "python -m pytest".
+'''
+import json
+import random
+import sqlite3
+import time
+
+import cherrypy
+import pytest
+
+import cherrypy_demo
+
+@pytest.fixture
+def conn( tmp_path, monkeypatch ):
+    '''
+    A connection to a fresh database, the demo uses it instead of demo.db (with its own schema
+    cache, the schema_version of a fresh database starts again).
+    '''
+    manager = cherrypy_demo.SQLiteConnectionManager( cherrypy.engine, str( tmp_path / "test.db" ) )
+    monkeypatch.setattr( cherrypy_demo, "db_manager", manager )
+    monkeypatch.setattr( cherrypy_demo, "schema_cache", cherrypy_demo.SchemaCache() )
+    cherrypy_demo.invalidate_all_caches()
+    yield manager.connection()
+    manager.stop()
+    cherrypy_demo.invalidate_all_caches()
+
+@pytest.fixture
+def executor( conn, monkeypatch ):
+    '''
+    A running DB executor for the handlers, with the connections of the conn fixture.
+    '''
+    executor = cherrypy_demo.DBExecutor( cherrypy.engine, cherrypy_demo.db_manager )
+    monkeypatch.setattr( cherrypy_demo, "db_executor", executor )
+    executor.start()
+    yield executor
+    executor.stop()
+
+def grid_page( conn, table_name, **request ):
+    return json.loads( cherrypy_demo.select_grid_page( conn, table_name, request ) )
+
+def test_keyset_paging_with_integer_primary_key( conn ):
+    # "select rowid, r.*" returns the columns "id", "id", "name" for a rowid alias
+    with conn:
+        conn.execute( "create table r( id integer primary key, name text )" )
+        conn.executemany( "insert into r( name ) values( ? )", [ ( "n{0}".format( i ), ) for i in range( 5 ) ] )
+    recids = []
+    for offset in range( 0, 5, 2 ):
+        page = grid_page( conn, "r", limit=2, offset=offset, sort=[ { "field": "name", "direction": "desc" } ] )
+        assert page["status"] == "success"
+        assert page["total"] == 5
+        recids.extend( record["recid"] for record in page["records"] )
+    assert recids == [ 5, 4, 3, 2, 1 ]
+
+def test_contains_on_column_without_fts( conn ):
+    # the FTS5 table only has the TEXT columns, "a" (no type, BLOB affinity) needs a like
+    with conn:
+        conn.execute( "create table u( a, b text )" )
+        conn.executemany( "insert into u values( ?, ? )", [ ( "abcdef", "uvwxyz" ), ( "ghijkl", "abcdef" ) ] )
+    cherrypy_demo.index_advisor._create_fts_table( conn, "u", cherrypy_demo.schema_cache.columns( conn, "u" ) )
+    for field, recids in [ ( "a", [ 1 ] ), ( "b", [ 2 ] ) ]:
+        page = grid_page( conn, "u", search=[ { "field": field, "operator": "contains", "value": "bcd" } ] )
+        assert page["status"] == "success"
+        assert [ record["recid"] for record in page["records"] ] == recids
+
+def test_keyset_paging_with_nulls( conn ):
+    # with "desc" the NULLs come last, the seek behind a value must not skip them
+    with conn:
+        conn.execute( "create table s( name text, score integer )" )
+        conn.executemany( "insert into s values( ?, ? )", [ ( "a", 1 ), ( "b", None ), ( "c", 3 ), ( "d", 1 ), ( "e", 5 ) ] )
+    for direction, expected in [ ( "desc", [ 5, 3, 1, 4, 2 ] ), ( "asc", [ 2, 1, 4, 3, 5 ] ) ]:
+        recids = []
+        for offset in range( 0, 5, 2 ):
+            page = grid_page( conn, "s", limit=2, offset=offset, sort=[ { "field": "score", "direction": direction } ] )
+            recids.extend( record["recid"] for record in page["records"] )
+        assert recids == expected
+
+def test_index_advisor_builds_in_background( conn ):
+    with conn:
+        conn.execute( "create table v( name text, score integer )" )
+    advisor = cherrypy_demo.IndexAdvisor( cherrypy.engine, threshold=2 )
+    columns = cherrypy_demo.schema_cache.columns( conn, "v" )
+    for _ in range( 2 ):
+        advisor.record( "v", columns, [ { "field": "score", "operator": "more", "value": 1 } ], [ ( "rowid", "asc" ) ] )
+    # the request returns at once, the index is built by the background thread
+    for _ in range( 100 ):
+        indexes = [ row[1] for row in conn.execute( "PRAGMA index_list( v )" ) ]
+        if indexes:
+            break
+        time.sleep( 0.05 )
+    advisor.stop()
+    assert indexes == [ "ix_auto_v_score" ]
+
+def test_invalid_limit_is_a_w2ui_error( conn ):
+    with conn:
+        conn.execute( "create table w( name text )" )
+    page = grid_page( conn, "w", limit="ten", offset=0 )
+    assert page["status"] == "error"
+
+def test_paging_cache_counts_are_bounded():
+    cache = cherrypy_demo.GridPagingCache( max_counts=2 )
+    for value in range( 3 ):
+        cache.set_count( "t", "a = ?", [ value ], value, cache.generation( "t" ) )
+    assert cache.get_count( "t", "a = ?", [ 0 ] ) is None
+    assert cache.get_count( "t", "a = ?", [ 2 ] ) == 2
+
+def test_paging_cache_drops_stale_stores():
+    # a count or boundary, selected before a write, is not stored after the write
+    cache = cherrypy_demo.GridPagingCache()
+    for reset in ( lambda: cache.invalidate( "t" ), cache.clear ):
+        generation = cache.generation( "t" )
+        reset()
+        cache.set_count( "t", "", [], 1, generation )
+        cache.set_boundary( "t", "", [], "order by rowid", 1, ( 1, ), generation )
+        assert cache.get_count( "t", "", [] ) is None
+        assert cache.get_boundary( "t", "", [], "order by rowid", 1 ) is None
+
+def test_internal_tables_are_unknown( conn ):
+    with conn:
+        conn.execute( "create table x( id integer primary key autoincrement, name text )" )
+        conn.execute( "insert into x( name ) values( 'a' )" )
+    with conn:
+        conn.execute( "create table x_changes( version integer primary key, row_id integer )" )
+    for table_name in [ "sqlite_sequence", "x_changes" ]:
+        assert grid_page( conn, table_name )["status"] == "error"
+        with pytest.raises( ValueError ):
+            cherrypy_demo.schema_cache.columns( conn, table_name )
+    assert grid_page( conn, "x" )["status"] == "success"
+
+def search_recids( conn, table_name, search ):
+    page = grid_page( conn, table_name, limit=100, offset=0, search=[ search ] )
+    assert page["status"] == "success", page
+    return [ record["recid"] for record in page["records"] ]
+
+@pytest.mark.parametrize( "operator, value, recids", [
+    ( "=",       2,          [ 2 ] ),
+    ( "is",      "2",        [ 2 ] ),
+    ( "between", [ 2, 4 ],   [ 2, 3, 4 ] ),
+    ( ">",       3,          [ 4, 5 ] ),
+    ( "more",    "3",        [ 4, 5 ] ),
+    ( "<",       3,          [ 1, 2 ] ),
+    ( "less",    3,          [ 1, 2 ] ),
+    ( ">=",      3,          [ 3, 4, 5 ] ),
+    ( "<=",      3,          [ 1, 2, 3 ] ),
+    ( "in",      [ 1, "5" ], [ 1, 5 ] ),
+    ( "not in",  [ 1, 5 ],   [ 2, 3, 4 ] ),
+] )
+def test_number_operators( conn, operator, value, recids ):
+    with conn:
+        conn.execute( "create table n( score integer )" )
+        conn.executemany( "insert into n values( ? )", [ ( i, ) for i in range( 1, 6 ) ] )
+    assert search_recids( conn, "n", { "field": "score", "type": "int", "operator": operator, "value": value } ) == recids
+
+@pytest.mark.parametrize( "operator, value, recids", [
+    ( "is",      "1/2/2024",                 [ 2 ] ),
+    ( "=",       "2024-01-02",               [ 2 ] ),
+    ( "between", [ "2024-01-02", "1/3/2024" ], [ 2, 3 ] ),
+    ( "less",    "2024-01-02",               [ 1 ] ),
+    ( "<",       "2024-01-02",               [ 1 ] ),
+    ( "more",    "2024-01-02",               [ 3 ] ),
+    ( ">",       "2024-01-02",               [ 3 ] ),
+    ( "<=",      "2024-01-02",               [ 1, 2 ] ),
+    ( ">=",      "2024-01-02",               [ 2, 3 ] ),
+] )
+def test_date_operators( conn, operator, value, recids ):
+    # dates with a time match their day
+    with conn:
+        conn.execute( "create table d( born date )" )
+        conn.executemany( "insert into d values( ? )", [ ( "2024-01-01",), ( "2024-01-02 13:45:00", ), ( "2024-01-03", ) ] )
+    assert search_recids( conn, "d", { "field": "born", "type": "date", "operator": operator, "value": value } ) == recids
+
+def test_unknown_number_operator( conn ):
+    with conn:
+        conn.execute( "create table n( score integer )" )
+    page = grid_page( conn, "n", search=[ { "field": "score", "operator": "begins", "value": 1 } ] )
+    assert page["status"] == "error"
+
+def test_begins_range_matches_like():
+    # the prefix range of "begins" finds the same rows as the case insensitive like
+    rng      = random.Random( 1 )
+    alphabet = "aAzZ@[`{_%\\bB~\x7féÉ퟿\U0010ffff01"
+    conn     = sqlite3.connect( ":memory:" )
+    conn.execute( "create table t( s text )" )
+    conn.executemany( "insert into t values( ? )", [ ( "".join( rng.choice( alphabet ) for _ in range( rng.randint( 0, 4 ) ) ), )
+                                                      for _ in range( 3000 ) ] )
+    for _ in range( 2000 ):
+        prefix = "".join( rng.choice( alphabet ) for _ in range( rng.randint( 1, 3 ) ) )
+        where, params = cherrypy_demo.compile_search( [ { "field": "s", "operator": "begins", "value": prefix } ], "AND", { "s": "TEXT" } )
+        by_range = conn.execute( "select count(*) from t where " + where, params ).fetchone()[0]
+        by_like  = conn.execute( "select count(*) from t where s like ? escape '\\'",
+                                 ( cherrypy_demo.escape_like( prefix ) + "%", ) ).fetchone()[0]
+        assert by_range == by_like, prefix
+    conn.close()
+
+@pytest.mark.parametrize( "request_", [
+    { "search": "fname" },
+    { "search": [ "fname" ] },
+    { "search": [ { "field": [ "fname" ], "operator": "is", "value": 1 } ] },
+    { "searchLogic": 1 },
+    { "sort": [ "fname" ] },
+    { "sort": [ { "field": "fname", "direction": 1 } ] },
+] )
+def test_invalid_request_shape_is_a_w2ui_error( conn, request_ ):
+    with conn:
+        conn.execute( "create table w( fname text )" )
+    assert grid_page( conn, "w", **request_ )["status"] == "error"
+
+def test_table_without_rowid_is_a_w2ui_error( conn, executor ):
+    with conn:
+        conn.execute( "create table k( name text primary key ) without rowid" )
+        conn.execute( "create view kv as select name from k" )
+    handler = cherrypy_demo.HelloWorld()
+    for table_name, message in [ ( "k", "no such column: rowid" ), ( [ "k" ], "Unknown table" ) ]:
+        body = json.loads( handler.get_table_data_all( request=json.dumps( { "table_name": table_name } ) ) )
+        assert body["status"] == "error"
+        assert message in body["message"]
+    # the rowid of a view depends on the build of SQLite ( NULL or "no such column" ), never a 500
+    body = json.loads( handler.get_table_data_all( request=json.dumps( { "table_name": "kv" } ) ) )
+    assert body["status"] in ( "success", "error" )
+    assert json.loads( handler.get_table_data_all( request="[]" ) )["status"] == "error"
+
+@pytest.mark.parametrize( "changes", [
+    [ "fname" ], [ None ], { "recid": 1 }, [ { "recid": True, "fname": "x" } ], [ { "recid": "one", "fname": "x" } ],
+] )
+def test_invalid_changes_are_a_w2ui_error( conn, executor, changes ):
+    with conn:
+        conn.execute( "create table s( fname text )" )
+        conn.execute( "insert into s values( 'a' )" )
+    handler = cherrypy_demo.HelloWorld()
+    body    = json.loads( handler.save_table_data( request=json.dumps( { "table_name": "s", "changes": changes } ) ) )
+    assert body["status"] == "error"
+    assert conn.execute( "select rowid, fname from s" ).fetchall() == [ ( 1, "a" ) ]
+
+def test_numeric_string_recid_is_an_update( conn, executor ):
+    with conn:
+        conn.execute( "create table s( fname text )" )
+        conn.execute( "insert into s values( 'a' )" )
+    handler = cherrypy_demo.HelloWorld()
+    changes = [ { "recid": "1", "fname": "b" }, { "fname": "c" } ]
+    body    = json.loads( handler.save_table_data( request=json.dumps( { "table_name": "s", "changes": changes } ) ) )
+    assert body["status"] == "success"
+    assert conn.execute( "select rowid, fname from s" ).fetchall() == [ ( 1, "b" ), ( 2, "c" ) ]
+
+def test_mirror_updates_in_place( conn, tmp_path ):
+    with conn:
+        conn.execute( "create table m( fname text )" )
+        conn.executemany( "insert into m values( ? )", [ ( "a", ), ( "b", ), ( "c", ) ] )
+    mirror = cherrypy_demo.MemoryMirror( cherrypy.engine, str( tmp_path / "test.db" ), tables=[ "m" ], enabled=True )
+    mirror.resync()
+    try:
+        # the row counts, a reader sees during the write through
+        mirror._writer.execute( "create temp table seen( n )" )
+        for event in ( "insert", "update", "delete" ):
+            mirror._writer.execute( "create temp trigger seen_{0} after {0} on main.m begin "
+                                    "insert into seen select count(*) from main.m; end".format( event ) )
+        with conn:
+            conn.execute( "update m set fname = 'x' where rowid = 1" )
+            conn.execute( "delete from m where rowid = 2" )
+            conn.execute( "insert into m values( 'd' )" )
+        mirror.write_through( "m", deleted=[ 2 ], changed=[ 1, 4 ] )
+        assert mirror.connection().execute( "select rowid, fname from m" ).fetchall() == [ ( 1, "x" ), ( 3, "c" ), ( 4, "d" ) ]
+        # only the deleted row 2 is missing, never the saved rows 1 and 3
+        assert min( n for ( n, ) in mirror._writer.execute( "select n from seen" ) ) == 2
+    finally:
+        mirror.stop()
+
+def test_changes_are_read_in_one_snapshot( conn, tmp_path, monkeypatch ):
+    monkeypatch.setattr( cherrypy_demo, "change_tracker", cherrypy_demo.ChangeTracker( tables=[ "c" ] ) )
+    with conn:
+        conn.execute( "create table c( fname text )" )
+    cherrypy_demo.change_tracker.ensure( conn, "c" )
+    with conn:
+        conn.execute( "insert into c values( 'a' )" )
+    other = sqlite3.connect( str( tmp_path / "test.db" ) )
+
+    def commit_in_between( statement ):
+        # another connection commits between the version and the changes
+        if "c.version" in statement:
+            with other:
+                other.execute( "insert into c values( 'b' )" )
+    conn.set_trace_callback( commit_in_between )
+    try:
+        result = cherrypy_demo.select_changes( conn, "c", 0 )
+    finally:
+        conn.set_trace_callback( None )
+        other.close()
+    assert result["version"] == 1
+    assert [ record["fname"] for record in result["inserted"] ] == [ "a" ]
+
+def test_own_writes_keep_the_caches_of_other_tables( conn, executor, tmp_path ):
+    with conn:
+        conn.execute( "create table s( fname text )" )
+        conn.execute( "create table o( fname text )" )
+    manager = cherrypy_demo.db_manager
+    manager.data_version_changed()
+    handler = cherrypy_demo.HelloWorld()
+    body    = json.loads( handler.save_table_data( request=json.dumps( { "table_name": "s", "changes": [ { "fname": "a" } ] } ) ) )
+    assert body["status"] == "success"
+    assert not manager.data_version_changed()
+    # the write of another process drops all caches
+    other = sqlite3.connect( str( tmp_path / "test.db" ) )
+    with other:
+        other.execute( "insert into o values( 'b' )" )
+    other.close()
+    assert manager.data_version_changed()